@@ -0,0 +1,146 @@
+"""主循环单帧基准测试。
+
+用 Streamlit 的 AppTest 无头运行 streamlit_app.py，通过 session_state 注入
+bench_frames 让主循环只跑 N 帧 (每帧同步生成事件、不等待)，统计：
+
+- 每帧总耗时与各阶段 (events / cleanup / stats / birth_map / death_map / table) 的分位数
+- 进程峰值 RSS
+- tracemalloc 统计的内存分配峰值 (单独再跑一轮，避免追踪开销污染计时)
+
+结果写成 JSON，可用 --compare 与另一次提交的结果对比。
+
+    python benchmarks/bench_frame.py --frames 300
+    python benchmarks/bench_frame.py --frames 300 --time-scale 3600
+    python benchmarks/bench_frame.py --compare benchmarks/results/frame-abc1234.json
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP = os.path.join(ROOT, "streamlit_app.py")
+STAGES = ["events", "cleanup", "stats", "birth_map", "death_map", "table"]
+PERCENTILES = [50, 90, 99]
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True, stderr=subprocess.DEVNULL
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def summarize(samples):
+    """秒 -> 毫秒的分位数摘要。"""
+    ms = sorted(x * 1000 for x in samples)
+    if not ms:
+        return {}
+    cuts = statistics.quantiles(ms, n=100, method="inclusive") if len(ms) > 1 else ms * 99
+    out = {f"p{p}": round(cuts[p - 1], 4) for p in PERCENTILES}
+    out.update(mean=round(statistics.fmean(ms), 4), max=round(ms[-1], 4))
+    return out
+
+
+def run(frames, warmup, time_scale=1):
+    """在新会话里跑 warmup + frames 帧，返回计入统计的逐帧分段耗时和总墙钟时间。"""
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(APP, default_timeout=max(60, frames))
+    at.session_state["bench_frames"] = frames + warmup
+    at.session_state["frame_log"] = []
+    at.session_state["time_scale"] = time_scale
+
+    started = time.perf_counter()
+    at.run()
+    wall = time.perf_counter() - started
+
+    if at.exception:
+        raise SystemExit(f"应用运行出错: {at.exception[0].value}")
+    return at.session_state["frame_log"][warmup:], wall
+
+
+def measure_allocations(frames, time_scale):
+    tracemalloc.start()
+    run(frames, 0, time_scale)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def report(log, wall, alloc_peak, frames, warmup, time_scale):
+    totals = [sum(f.values()) for f in log]
+    # ru_maxrss 在 Linux 上是 KB，在 macOS 上是字节
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    rss_mb = rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+    import streamlit
+
+    return {
+        "commit": git_commit(),
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "streamlit": streamlit.__version__,
+        "frames": frames,
+        "warmup": warmup,
+        "time_scale": time_scale,
+        "wall_s": round(wall, 3),
+        "peak_rss_mb": round(rss_mb, 1),
+        "alloc_peak_mb": round(alloc_peak / (1024 * 1024), 3),
+        "frame_ms": summarize(totals),
+        "stages_ms": {name: summarize([f.get(name, 0.0) for f in log]) for name in STAGES},
+    }
+
+
+def compare(current, baseline):
+    """打印与基线结果的 p50/p90 差异 (正数表示变慢)。"""
+    rows = [("frame", current["frame_ms"], baseline["frame_ms"])]
+    rows += [(n, current["stages_ms"].get(n, {}), baseline["stages_ms"].get(n, {})) for n in STAGES]
+    print(f"\n对比基线 {baseline.get('commit')} -> {current.get('commit')}")
+    for name, cur, base in rows:
+        cells = []
+        for key in ("p50", "p90"):
+            if key in cur and key in base and base[key]:
+                cells.append(f"{key} {base[key]:.3f} -> {cur[key]:.3f} ms ({(cur[key] / base[key] - 1) * 100:+.0f}%)")
+        print(f"  {name:<10} " + "  ".join(cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="streamlit_app.py 主循环单帧基准测试")
+    parser.add_argument("--frames", type=int, default=200, help="计入统计的帧数")
+    parser.add_argument("--warmup", type=int, default=20, help="预热帧数 (不计入统计)")
+    parser.add_argument("--time-scale", type=int, default=1, help="模拟时间加速倍数 (1 / 60 / 3600)")
+    parser.add_argument("--out", help="结果 JSON 路径，默认 benchmarks/results/frame-<commit>.json")
+    parser.add_argument("--compare", help="与之对比的基线结果 JSON")
+    args = parser.parse_args()
+
+    # 应用的数据库、事件日志、共享计数和会话快照都放在 ~ 下，压测期间指向临时目录，不碰正式环境的文件
+    home = tempfile.TemporaryDirectory(prefix="bench-frame-")
+    os.environ["HOME"] = home.name
+    log, wall = run(args.frames, args.warmup, args.time_scale)
+    alloc_peak = measure_allocations(args.frames, args.time_scale)
+    result = report(log, wall, alloc_peak, args.frames, args.warmup, args.time_scale)
+
+    out = args.out or os.path.join(ROOT, "benchmarks", "results", f"frame-{result['commit']}.json")
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    print(f"\n结果已保存到 {out}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(result, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
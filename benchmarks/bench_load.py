@@ -0,0 +1,369 @@
+"""多会话压测。
+
+在本机起一个 `streamlit run streamlit_app.py`，用 websocket 协议模拟 K 个并发浏览器会话：
+每个会话发起首次运行，之后像浏览器一样按服务端下发的 auto_rerun 间隔请求片段重跑
+(上一轮没跑完时不叠加请求)。全部连上后保持 --duration 秒，统计：
+
+- 服务进程 CPU (按 /proc/<pid>/stat 折算，100% 为一个核心) 与 RSS 增长
+- 下发的 delta 消息吞吐 (含引用缓存的 ref_hash 消息) 与字节数
+- 实时区域片段实际的帧间隔 (两次片段运行完成之间) 与片段 run_every 的对比，以及请求到运行完成的延迟
+
+--sessions 可给多个值，每档各起一个新服务进程，用来找出扩展拐点。结果写成 JSON，可用 --compare 对比。
+CPU / RSS 依赖 Linux 的 /proc；压测用到 websockets 库 (Streamlit 服务端依赖里通常已经带上)。
+
+    python benchmarks/bench_load.py --sessions 10 25 50 100 --duration 30
+    python benchmarks/bench_load.py --url ws://localhost:8501/_stcore/stream --pid 12345 --sessions 50
+    python benchmarks/bench_load.py --sessions 50 --compare benchmarks/results/load-abc1234.json
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP = os.path.join(ROOT, "streamlit_app.py")
+PERCENTILES = [50, 90, 99]
+SAMPLE_INTERVAL = 1.0  # 采样服务进程 CPU / RSS 的间隔（秒）
+WARMUP_SECONDS = 3.0   # 正式压测前预热会话保持的秒数
+FRAGMENT_RUN_DONE = 3  # ForwardMsg.FINISHED_FRAGMENT_RUN_SUCCESSFULLY
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True, stderr=subprocess.DEVNULL
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def summarize(samples):
+    """秒 -> 毫秒的分位数摘要。"""
+    ms = sorted(x * 1000 for x in samples)
+    if not ms:
+        return {}
+    cuts = statistics.quantiles(ms, n=100, method="inclusive") if len(ms) > 1 else ms * 99
+    out = {f"p{p}": round(cuts[p - 1], 2) for p in PERCENTILES}
+    out.update(mean=round(statistics.fmean(ms), 2), max=round(ms[-1], 2))
+    return out
+
+
+# ==========================================
+# 服务进程：启动与 /proc 采样
+# ==========================================
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(port, home, timeout=60):
+    """后台起一个无头 Streamlit 服务，等健康检查通过后返回进程对象。
+    HOME 指向临时目录：应用的数据库、事件日志、共享计数、选举锁和会话快照都在 ~ 下，不碰正式环境的文件。"""
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "streamlit", "run", APP,
+         "--server.headless", "true", "--server.port", str(port),
+         "--server.fileWatcherType", "none", "--browser.gatherUsageStats", "false"],
+        cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env={**os.environ, "HOME": home},
+    )
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit(f"Streamlit 服务启动失败 (退出码 {proc.returncode})")
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/_stcore/health", timeout=1) as r:
+                if r.status == 200:
+                    return proc
+        except OSError:
+            time.sleep(0.2)
+    proc.kill()
+    raise SystemExit("等待 Streamlit 服务启动超时")
+
+
+def proc_sample(pid):
+    """(累计 CPU 秒, RSS 字节)；没有 /proc 或进程已退出时返回 None。"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            # 进程名可能带空格，从最后一个右括号之后按空格切分；utime / stime 是第 14、15 个字段
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open(f"/proc/{pid}/statm") as f:
+            rss_pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    cpu = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    return cpu, rss_pages * os.sysconf("SC_PAGE_SIZE")
+
+
+async def sample_server(pid, samples, stop):
+    while not stop.is_set():
+        sample = proc_sample(pid)
+        if sample:
+            samples.append((time.monotonic(), *sample))
+        try:
+            await asyncio.wait_for(stop.wait(), SAMPLE_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+
+# ==========================================
+# 模拟浏览器会话
+# ==========================================
+class SimSession:
+    """一个模拟的浏览器标签页：首次运行 + 按 auto_rerun 间隔请求片段重跑，记录消息和片段运行时间。"""
+
+    def __init__(self, url):
+        self.url = url
+        self.hashes = set()      # 已缓存的消息哈希，重跑时报给服务端，未变化的大消息只回 ref_hash
+        self.intervals = {}      # 片段 id -> 自动重跑间隔
+        self.timers = {}
+        self.requested = {}      # 片段 id -> 请求重跑的时刻；运行完成前不再重复请求
+        self.run_fragments = ()
+        self.finished = {}       # 片段 id -> 各次运行完成的时刻
+        self.latency = {}        # 片段 id -> 各次 (完成时刻, 请求到完成的耗时)
+        self.deltas = 0
+        self.bytes = 0
+        self.error = None
+        self.ws = None
+
+    async def run(self, stop):
+        import websockets
+        from streamlit.proto.BackMsg_pb2 import BackMsg
+        from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+        self.BackMsg = BackMsg
+        try:
+            async with websockets.connect(self.url, subprotocols=["streamlit"], max_size=None, open_timeout=30) as ws:
+                self.ws = ws
+                await self.send()
+                async for raw in ws:
+                    msg = ForwardMsg()
+                    msg.ParseFromString(raw)
+                    self.on_message(msg, len(raw))
+                    if stop.is_set():
+                        break
+        except Exception as e:  # 连接被拒、服务端断开等都记为该会话失败
+            if not stop.is_set():
+                self.error = repr(e)
+        finally:
+            for timer in self.timers.values():
+                timer.cancel()
+
+    async def send(self, fragment_id=""):
+        back = self.BackMsg()
+        back.rerun_script.query_string = ""
+        if fragment_id:
+            back.rerun_script.fragment_id = fragment_id
+            back.rerun_script.is_auto_rerun = True
+        back.rerun_script.cached_message_hashes.extend(self.hashes)
+        await self.ws.send(back.SerializeToString())
+
+    async def auto_rerun(self, fragment_id, interval):
+        while True:
+            await asyncio.sleep(interval)
+            if fragment_id in self.requested:
+                continue
+            self.requested[fragment_id] = time.monotonic()
+            await self.send(fragment_id)
+
+    def on_message(self, msg, size):
+        kind = msg.WhichOneof("type")
+        if msg.metadata.cacheable:
+            self.hashes.add(msg.hash)
+        if kind in ("delta", "ref_hash"):
+            self.deltas += 1
+            self.bytes += size
+        elif kind == "new_session":
+            self.run_fragments = tuple(msg.new_session.fragment_ids_this_run)
+        elif kind == "auto_rerun":
+            fid, interval = msg.auto_rerun.fragment_id, msg.auto_rerun.interval
+            if fid not in self.timers:
+                self.intervals[fid] = interval
+                self.timers[fid] = asyncio.create_task(self.auto_rerun(fid, interval))
+        elif kind == "stop_auto_rerun":
+            for fid in msg.stop_auto_rerun.fragment_ids:
+                timer = self.timers.pop(fid, None)
+                if timer:
+                    timer.cancel()
+        elif kind == "script_finished" and msg.script_finished == FRAGMENT_RUN_DONE:
+            now = time.monotonic()
+            for fid in self.run_fragments:
+                self.finished.setdefault(fid, []).append(now)
+                asked = self.requested.pop(fid, None)
+                if asked is not None:
+                    self.latency.setdefault(fid, []).append((now, now - asked))
+
+    def live_fragment(self):
+        """定时重跑的片段里最快的就是实时区域 (run_every=LIVE_REFRESH_RATE)。"""
+        return min(self.intervals, key=self.intervals.get) if self.intervals else None
+
+
+# ==========================================
+# 一档并发：爬坡、保持、统计
+# ==========================================
+async def load_level(url, pid, sessions, ramp, duration):
+    # 先用一个会话预热 (首个会话会触发模块导入和进程级缓存)，之后的 RSS 增长才算在会话头上
+    warm, warm_stop = SimSession(url), asyncio.Event()
+    warm_task = asyncio.create_task(warm.run(warm_stop))
+    await asyncio.sleep(WARMUP_SECONDS)
+    warm_stop.set()
+    warm_task.cancel()
+    await asyncio.gather(warm_task, return_exceptions=True)
+
+    stop = asyncio.Event()
+    samples = []
+    sampler = asyncio.create_task(sample_server(pid, samples, stop)) if pid else None
+    before = proc_sample(pid) if pid else None
+
+    clients = [SimSession(url) for _ in range(sessions)]
+    tasks = []
+    for client in clients:
+        tasks.append(asyncio.create_task(client.run(stop)))
+        await asyncio.sleep(ramp / sessions)
+    # 爬坡结束后统一清零，只统计保持阶段
+    await asyncio.sleep(1.0)
+    hold_start = time.monotonic()
+    start_deltas = [(c.deltas, c.bytes) for c in clients]
+    loaded = proc_sample(pid) if pid else None
+    await asyncio.sleep(duration)
+    hold_end = time.monotonic()
+    end = proc_sample(pid) if pid else None
+    deltas = sum(c.deltas - d for c, (d, _) in zip(clients, start_deltas))
+    sent = sum(c.bytes - b for c, (_, b) in zip(clients, start_deltas))
+
+    stop.set()
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    if sampler:
+        await sampler
+
+    intervals, latency, targets = [], [], set()
+    for c in clients:
+        fid = c.live_fragment()
+        if fid is None:
+            continue
+        targets.add(round(c.intervals[fid], 3))
+        done = [t for t in c.finished.get(fid, []) if hold_start <= t <= hold_end]
+        intervals += [b - a for a, b in zip(done, done[1:])]
+        latency += [dt for t, dt in c.latency.get(fid, []) if hold_start <= t <= hold_end]
+
+    target = min(targets) if targets else None
+    frame = summarize(intervals)
+    result = {
+        "sessions": sessions,
+        "connected": sum(1 for c in clients if c.intervals),
+        "errors": sorted({c.error for c in clients if c.error})[:5],
+        "duration_s": round(hold_end - hold_start, 2),
+        "deltas_per_s": round(deltas / (hold_end - hold_start), 1),
+        "kb_per_s": round(sent / 1024 / (hold_end - hold_start), 1),
+        "target_interval_ms": round(target * 1000) if target else None,
+        "frame_interval_ms": frame,
+        "frame_slowdown": round(frame["p50"] / (target * 1000), 2) if frame and target else None,
+        "run_latency_ms": summarize(latency),
+    }
+    if loaded and end:
+        result.update(
+            cpu_percent=round((end[0] - loaded[0]) / (hold_end - hold_start) * 100, 1),
+            rss_mb={
+                "before": round(before[1] / 2**20, 1),
+                "loaded": round(loaded[1] / 2**20, 1),
+                "end": round(end[1] / 2**20, 1),
+                "peak": round(max(s[2] for s in samples) / 2**20, 1) if samples else None,
+            },
+            rss_growth_mb=round((end[1] - loaded[1]) / 2**20, 1),
+            rss_per_session_kb=round((loaded[1] - before[1]) / 1024 / sessions, 1),
+        )
+    return result
+
+
+def run_level(args, sessions):
+    """每档一个新服务进程 (给了 --url 时压已有服务)，返回该档的统计。"""
+    if args.url is not None:
+        return asyncio.run(load_level(args.url, args.pid, sessions, args.ramp, args.duration))
+    with tempfile.TemporaryDirectory(prefix="bench-load-") as home:
+        port = free_port()
+        proc = start_server(port, home)
+        try:
+            return asyncio.run(load_level(f"ws://127.0.0.1:{port}/_stcore/stream", proc.pid, sessions, args.ramp, args.duration))
+        finally:
+            proc.terminate()
+            try:
+                proc.wait(10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+
+def report(levels, args):
+    import streamlit
+
+    return {
+        "commit": git_commit(),
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "streamlit": streamlit.__version__,
+        "cpus": os.cpu_count(),
+        "ramp_s": args.ramp,
+        "levels": levels,
+    }
+
+
+def compare(current, baseline):
+    """按会话数对齐，打印帧间隔 p50 / CPU / RSS 增长的差异。"""
+    base = {lvl["sessions"]: lvl for lvl in baseline.get("levels", [])}
+    print(f"\n对比基线 {baseline.get('commit')} -> {current.get('commit')}")
+    for lvl in current["levels"]:
+        old = base.get(lvl["sessions"])
+        if not old:
+            continue
+        cells = []
+        for name, cur, prev in (
+            ("frame p50", lvl["frame_interval_ms"].get("p50"), old["frame_interval_ms"].get("p50")),
+            ("cpu%", lvl.get("cpu_percent"), old.get("cpu_percent")),
+            ("rss+MB", lvl.get("rss_growth_mb"), old.get("rss_growth_mb")),
+        ):
+            if cur is not None and prev is not None:
+                cells.append(f"{name} {prev} -> {cur}")
+        print(f"  {lvl['sessions']:>4} 会话  " + "  ".join(cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="streamlit_app.py 多会话压测")
+    parser.add_argument("--sessions", type=int, nargs="+", default=[10], help="并发会话数，可给多档")
+    parser.add_argument("--duration", type=float, default=30, help="全部连上后保持的秒数")
+    parser.add_argument("--ramp", type=float, default=5, help="逐个建立会话用的秒数")
+    parser.add_argument("--url", help="压已有服务的 websocket 地址，不再自己启动 (ws://host:port/_stcore/stream)")
+    parser.add_argument("--pid", type=int, help="已有服务的进程号，用于采样 CPU / RSS")
+    parser.add_argument("--out", help="结果 JSON 路径，默认 benchmarks/results/load-<commit>.json")
+    parser.add_argument("--compare", help="与之对比的基线结果 JSON")
+    args = parser.parse_args()
+
+    levels = []
+    for sessions in args.sessions:
+        level = run_level(args, sessions)
+        levels.append(level)
+        print(json.dumps(level, ensure_ascii=False), flush=True)
+    result = report(levels, args)
+
+    out = args.out or os.path.join(ROOT, "benchmarks", "results", f"load-{result['commit']}.json")
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    print(f"\n结果已保存到 {out}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(result, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
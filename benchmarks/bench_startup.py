@@ -0,0 +1,138 @@
+"""冷启动基准测试。
+
+在全新的 Python 进程里用 AppTest 运行 streamlit_app.py，统计脚本本身的执行耗时：
+
+- 冷进程第一次运行脚本的耗时 (含应用自身的 import、首个会话初始化)
+- 同一进程里新会话第一次运行的耗时 (新访客)
+- 已有会话重跑一次的耗时
+- 应用 import 之后新增的模块数，以及 pandas / pydeck 是否在首次运行时被加载
+
+每个指标重复 --repeat 次 (每次一个新进程) 取中位数，结果写成 JSON，可用 --compare 对比。
+
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --compare benchmarks/results/startup-abc1234.json
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP = os.path.join(ROOT, "streamlit_app.py")
+METRICS = ["cold_first_run_ms", "new_session_ms", "rerun_ms"]
+
+# 在子进程中执行：先导入 streamlit 本身 (不计入)，再依次计时三种运行
+PROBE = """
+import json, sys, time
+from streamlit.runtime.scriptrunner import script_runner
+from streamlit.testing.v1 import AppTest
+
+# 只计脚本本身的执行时间：AppTest 建会话、解析消息的开销 (新会话约 200ms) 不计入
+durations = []
+run_script = script_runner.exec_func_with_error_handling
+
+def timed(*args, **kwargs):
+    started = time.perf_counter()
+    try:
+        return run_script(*args, **kwargs)
+    finally:
+        durations.append((time.perf_counter() - started) * 1000)
+
+script_runner.exec_func_with_error_handling = timed
+before = set(sys.modules)
+
+def timed_run(at):
+    at.run()
+    if at.exception:
+        raise SystemExit(at.exception[0].value)
+    return durations[-1]
+
+at = AppTest.from_file(sys.argv[1], default_timeout=60)
+cold = timed_run(at)
+loaded = set(sys.modules) - before
+rerun = timed_run(at)
+fresh = timed_run(AppTest.from_file(sys.argv[1], default_timeout=60))
+print(json.dumps({
+    "cold_first_run_ms": cold,
+    "new_session_ms": fresh,
+    "rerun_ms": rerun,
+    "modules_loaded": len(loaded),
+    "pandas_loaded": "pandas" in loaded,
+    "pydeck_loaded": "pydeck" in loaded,
+}))
+"""
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True, stderr=subprocess.DEVNULL
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def probe():
+    # HOME 指向临时目录：应用在 ~ 下的数据库、事件日志等文件不碰正式环境的
+    with tempfile.TemporaryDirectory(prefix="bench-startup-") as home:
+        out = subprocess.check_output(
+            [sys.executable, "-c", PROBE, APP], cwd=ROOT, text=True, stderr=subprocess.DEVNULL,
+            env={**os.environ, "HOME": home},
+        )
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def report(samples):
+    import streamlit
+
+    last = samples[-1]
+    return {
+        "commit": git_commit(),
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "streamlit": streamlit.__version__,
+        "repeat": len(samples),
+        **{name: round(statistics.median(s[name] for s in samples), 2) for name in METRICS},
+        "modules_loaded": last["modules_loaded"],
+        "pandas_loaded": last["pandas_loaded"],
+        "pydeck_loaded": last["pydeck_loaded"],
+    }
+
+
+def compare(current, baseline):
+    """打印与基线结果的中位数差异 (正数表示变慢)。"""
+    print(f"\n对比基线 {baseline.get('commit')} -> {current.get('commit')}")
+    for name in METRICS:
+        cur, base = current.get(name), baseline.get(name)
+        if cur is not None and base:
+            print(f"  {name:<18} {base:.1f} -> {cur:.1f} ms ({(cur / base - 1) * 100:+.0f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="streamlit_app.py 冷启动基准测试")
+    parser.add_argument("--repeat", type=int, default=5, help="重复次数 (每次一个新进程)")
+    parser.add_argument("--out", help="结果 JSON 路径，默认 benchmarks/results/startup-<commit>.json")
+    parser.add_argument("--compare", help="与之对比的基线结果 JSON")
+    args = parser.parse_args()
+
+    result = report([probe() for _ in range(args.repeat)])
+
+    out = args.out or os.path.join(ROOT, "benchmarks", "results", f"startup-{result['commit']}.json")
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    print(f"\n结果已保存到 {out}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(result, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
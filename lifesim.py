@@ -0,0 +1,1150 @@
+"""生死观测台的模拟核心：省份与区县地理、泊松事件抽样、事件引擎、会话状态 (地图点、排行榜、日志)、事件日志、多进程共享和状态快照。
+不依赖 Streamlit，界面 (streamlit_app.py) 只负责缓存这些对象和渲染。
+
+直接运行时不渲染，尽快跑完 N 模拟秒，报告吞吐、内存和各省分布相对期望的误差；
+加 --serve 时改为按真实时间运行，在本地 HTTP 端口上输出事件流 (NDJSON / SSE)：
+
+    python -m lifesim --seconds 86400
+    python -m lifesim --seconds 3600 --seed 1
+    python -m lifesim --serve 8765 && curl -N http://127.0.0.1:8765/events
+"""
+import argparse
+import atexit
+import csv
+import datetime
+import functools
+import json
+import os
+import queue
+import struct
+import sys
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows 没有 flock，按单进程部署处理
+    fcntl = None
+
+# ==========================================
+# 1. 省份数据
+# ==========================================
+# 各省坐标、常住人口 (万人) 与出生率/死亡率 (‰)，数据放在 data/provinces.csv
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+PROVINCE_FILE = os.path.join(DATA_DIR, "provinces.csv")
+SECONDS_PER_YEAR = 365.25 * 24 * 3600
+
+def load_provinces(path):
+    with open(path, encoding="utf-8", newline="") as f:
+        rows = list(csv.DictReader(f))
+    for row in rows:
+        for key in ("lat", "lon", "population", "birth_rate", "death_rate"):
+            row[key] = float(row[key])
+    return rows
+
+PROVINCES = load_provinces(PROVINCE_FILE)
+PROV_POPULATION = np.array([p['population'] * 1e4 for p in PROVINCES])
+# 年率 (‰) 换算成每秒期望事件数，作为泊松过程的强度
+PROV_BIRTH_RATE = PROV_POPULATION * np.array([p['birth_rate'] for p in PROVINCES]) / 1000 / SECONDS_PER_YEAR
+PROV_DEATH_RATE = PROV_POPULATION * np.array([p['death_rate'] for p in PROVINCES]) / 1000 / SECONDS_PER_YEAR
+PROV_INDEX = {p['zh']: i for i, p in enumerate(PROVINCES)}
+PROV_NAMES = {'zh': [p['zh'] for p in PROVINCES], 'en': [p['en'] for p in PROVINCES]}
+
+# ==========================================
+# 1.1 区县地理 (网格索引、视野裁剪)
+# ==========================================
+# 区县级坐标 (约 2800 个)，由 cpca 附带的行政区划坐标表 (MIT 许可) 整理而来
+PLACE_FILE = os.path.join(DATA_DIR, "places.csv")
+GRID_DEG = 1.0                # 网格索引的格子边长 (度)
+MAP_VIEWPORT_PX = (700, 500)  # 估算视野范围用的地图宽高 (像素)
+LOD_ZOOMS = ((6.0, 'county'), (4.5, 'city'), (0.0, 'province'))  # 缩放级别不低于该值时使用的细节层级
+
+class Geography:
+    """区县坐标存为按省份排序的列式数组，外加按 1° 网格预先排好的下标，视野查询只看覆盖到的格子。
+    落点用的随机数由 seed 派生 (与事件抽样同一个种子的子序列，两者互不相关)，固定种子时地图位置也可复现。"""
+
+    def __init__(self, path, seed=None):
+        with open(path, encoding="utf-8", newline="") as f:
+            rows = sorted(csv.DictReader(f), key=lambda r: PROV_INDEX[r['prov']])
+        self.lat = np.array([float(r['lat']) for r in rows], dtype=np.float32)
+        self.lon = np.array([float(r['lon']) for r in rows], dtype=np.float32)
+        self.prov = np.array([PROV_INDEX[r['prov']] for r in rows], dtype=np.int16)
+        self.names = [r['name'] for r in rows]
+        city_index = {}
+        self.city = np.array([city_index.setdefault(r['city'], len(city_index)) for r in rows], dtype=np.int32)
+        self.city_names = list(city_index)
+        self.count = np.bincount(self.prov, minlength=len(PROVINCES))
+        self.first = np.concatenate([[0], np.cumsum(self.count)[:-1]])
+        self.rng = np.random.default_rng(np.random.SeedSequence(seed).spawn(1)[0])
+
+        # 网格索引：格子按行优先编号，同一行相邻格子里的地点在 cell_order 中是连续的一段
+        self.lat0, self.lon0 = np.floor(self.lat.min()), np.floor(self.lon.min())
+        row = ((self.lat - self.lat0) // GRID_DEG).astype(np.int64)
+        col = ((self.lon - self.lon0) // GRID_DEG).astype(np.int64)
+        self.rows, self.cols = int(row.max()) + 1, int(col.max()) + 1
+        cell = row * self.cols + col
+        self.cell_order = np.argsort(cell, kind='stable')
+        self.cell_start = np.searchsorted(cell[self.cell_order], np.arange(self.rows * self.cols + 1))
+
+    def places(self, prov):
+        """在每个事件所属省份内挑一个区县。数据里没有区县人口，省内按区县等权抽取。"""
+        return (self.first[prov] + (self.rng.random(len(prov)) * self.count[prov]).astype(np.int64)).astype(np.int32)
+
+    @functools.lru_cache(maxsize=64)
+    def visible(self, lat, lon, zoom):
+        """视野内地点的布尔掩码。视野按 Web 墨卡托和 MAP_VIEWPORT_PX 估算，四周各留 1/4 余量给俯仰角。"""
+        width, height = MAP_VIEWPORT_PX
+        span_lon = 360.0 * width / (256 * 2 ** zoom) * 1.5
+        span_lat = span_lon * height / width * np.cos(np.radians(lat))
+        r0, r1 = (int((lat + d * span_lat / 2 - self.lat0) // GRID_DEG) for d in (-1, 1))
+        c0, c1 = (int((lon + d * span_lon / 2 - self.lon0) // GRID_DEG) for d in (-1, 1))
+        r0, r1, c0, c1 = max(r0, 0), min(r1, self.rows - 1), max(c0, 0), min(c1, self.cols - 1)
+        mask = np.zeros(len(self.names), dtype=bool)
+        if r0 > r1 or c0 > c1:
+            return mask  # 视野整个在网格外 (地图拖到了海上或国外)
+        for r in range(r0, r1 + 1):
+            mask[self.cell_order[self.cell_start[r * self.cols + c0]:self.cell_start[r * self.cols + c1 + 1]]] = True
+        return mask
+
+    @staticmethod
+    def level(zoom):
+        return next(name for min_zoom, name in LOD_ZOOMS if zoom >= min_zoom)
+
+    def keys(self, level, prov, place):
+        """按细节层级把每个标记映射到地区下标：省份 / 地级市 / 区县。"""
+        return {'province': prov, 'city': self.city[place], 'county': place}[level]
+
+    def labels(self, level, names):
+        # 区县和地级市只有中文名，英文界面也显示中文
+        return {'province': names, 'city': self.city_names, 'county': self.names}[level]
+
+# ==========================================
+# 2. 地图点环形缓冲 (定长、列式、类型化)
+# ==========================================
+POINT_TTL = 3.0      # 地图标记存活秒数
+MAP_CAPACITY = 512   # 每张地图最多同时保留的标记数
+MAP_MODE = "auto"    # "points" 逐点显示 / "province" 按地区聚合 / "auto" 标记数超过阈值时聚合
+AGGREGATE_THRESHOLD = 31
+
+class PointRing:
+    """列式环形缓冲：首次追加时按容量一次分配，之后追加 O(1) 不重新分配，按时间戳从最旧端过期；release 交还内存。"""
+
+    COLUMNS = (
+        ('lat', np.float32, ()), ('lon', np.float32, ()), ('rgba', np.uint8, (4,)), ('size', np.float32, ()),
+        ('ts', np.float64, ()), ('prov', np.int16, ()),
+        ('place', np.int32, ()),  # 区县下标，-1 表示只有省份
+    )
+    ROW_BYTES = sum(np.dtype(dtype).itemsize * int(np.prod(shape)) for _, dtype, shape in COLUMNS)
+
+    def __init__(self, capacity=MAP_CAPACITY):
+        self.capacity = capacity
+        self.release()
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def nbytes(self):
+        """各列实际分配的字节数：用过就是整个容量，交还后为零。"""
+        return len(self.ts) * self.ROW_BYTES
+
+    def release(self):
+        """清空全部标记并交还各列的内存 (换成空数组)，下次追加时再分配。"""
+        for name, dtype, shape in self.COLUMNS:
+            setattr(self, name, np.zeros((0, *shape), dtype=dtype))
+        self.start = 0  # 最旧一条所在下标
+        self.count = 0
+
+    def extend(self, lat, lon, rgba, size, ts, prov, place=-1):
+        """批量追加一组标记 (size/ts/place 可为标量)；满了就覆盖最旧的，超出容量只留最新的。"""
+        n = len(prov)
+        if n == 0:
+            return
+        if n > self.capacity:
+            keep = slice(n - self.capacity, None)
+            lat, lon, prov = lat[keep], lon[keep], prov[keep]
+            if rgba.ndim == 2:  # 单个颜色 (长度 4) 时所有点共用，不用裁剪
+                rgba = rgba[keep]
+            # size/ts/place 为标量时所有点共用，不用裁剪
+            size, ts, place = (col[keep] if np.ndim(col) else col for col in (size, ts, place))
+            n = self.capacity
+        if len(self.ts) < self.capacity:
+            # 新建或交还过的缓冲里没有标记，直接按容量分配
+            for name, dtype, shape in self.COLUMNS:
+                setattr(self, name, np.zeros((self.capacity, *shape), dtype=dtype))
+        idx = (self.start + self.count + np.arange(n)) % self.capacity
+        self.lat[idx], self.lon[idx], self.rgba[idx] = lat, lon, rgba
+        self.size[idx], self.ts[idx], self.prov[idx], self.place[idx] = size, ts, prov, place
+        overflow = max(self.count + n - self.capacity, 0)
+        self.count = min(self.count + n, self.capacity)
+        self.start = (self.start + overflow) % self.capacity
+
+    def expire(self, cutoff):
+        """丢弃时间戳不晚于 cutoff 的标记；时间戳按存放顺序单调递增，二分找到过期的条数后推进最旧端。"""
+        if not self.count or self.ts[self.start] > cutoff:
+            return 0
+        # 有效区至多绕回一次：先查尾段 [start, capacity)，全部过期再查开头绕回的部分
+        tail = self.ts[self.start:min(self.start + self.count, self.capacity)]
+        dropped = int(np.searchsorted(tail, cutoff, side='right'))
+        if dropped == len(tail) and dropped < self.count:
+            dropped += int(np.searchsorted(self.ts[:self.count - dropped], cutoff, side='right'))
+        return self.trim(dropped)
+
+    def trim(self, n):
+        """丢弃最旧的 n 条，返回实际丢弃的条数。"""
+        n = min(n, self.count)
+        if n:
+            self.start = (self.start + n) % self.capacity
+            self.count -= n
+        return n
+
+    def columns(self):
+        """按时间先后取出的各列，键与 extend 的参数同名，原样传回 extend 即可恢复。"""
+        idx = self.order()
+        return {name: getattr(self, name)[idx] for name, _, _ in self.COLUMNS}
+
+    def order(self):
+        """按时间先后排列的有效下标。"""
+        return (self.start + np.arange(self.count)) % self.capacity
+
+    def newer(self, ts):
+        """时间戳晚于 ts 的标记下标 (按时间先后)。"""
+        idx = self.order()
+        return idx[self.ts[idx] > ts]
+
+    def select(self, idx, names, geo=None, view=None):
+        """给了地理数据和视野 (lat, lon, zoom) 时裁掉视野外的标记，并按缩放级别选出地区下标和显示名。"""
+        if geo is None or view is None:
+            return idx, self.prov, names
+        level = geo.level(view[2])
+        return idx[geo.visible(*view)[self.place[idx]]], geo.keys(level, self.prov, self.place), geo.labels(level, names)
+
+    def records(self, idx, keys, labels):
+        """转成 pydeck 可直接使用的记录列表；keys 为每个槽位的地区下标，labels 为按地区下标排列的显示名。"""
+        return [
+            {"lat": round(float(lat), 4), "lon": round(float(lon), 4), "color": color, "size": float(size), "name": labels[k]}
+            for lat, lon, color, size, k in zip(
+                self.lat[idx], self.lon[idx], self.rgba[idx].tolist(), self.size[idx], keys[idx]
+            )
+        ]
+
+    def aggregate(self, idx, keys, labels):
+        """按地区聚合：每个有标记的地区只出一个点和一个标签，半径与透明度随近期事件数增长。"""
+        key = keys[idx]
+        counts = np.bincount(key, minlength=len(labels))
+        live = np.flatnonzero(counts)
+        n = counts[live]
+        mean = lambda col: np.bincount(key, weights=col, minlength=len(labels))[live] / n
+        lat, lon, size = mean(self.lat[idx]), mean(self.lon[idx]), mean(self.size[idx]) * np.sqrt(n)
+        rgba = np.stack([mean(self.rgba[idx, c]) for c in range(4)], axis=1)
+        rgba[:, 3] = np.minimum(rgba[:, 3] * (0.6 + 0.2 * np.log2(n)), 255)
+        return [
+            {"lat": round(float(la), 4), "lon": round(float(lo), 4), "color": color, "size": round(float(sz)),
+             "name": labels[k] if c == 1 else f"{labels[k]} ×{c}"}
+            for la, lo, color, sz, k, c in zip(lat, lon, rgba.astype(np.uint8).tolist(), size, live, n.tolist())
+        ]
+
+    def map_data(self, names, mode=MAP_MODE, geo=None, view=None):
+        """pydeck 地图数据：视野内的全部标记，数量多时按地区聚合。"""
+        idx, keys, labels = self.select(self.order(), names, geo, view)
+        aggregated = mode == "province" or (mode == "auto" and len(idx) > AGGREGATE_THRESHOLD)
+        return self.aggregate(idx, keys, labels) if aggregated else self.records(idx, keys, labels)
+
+# ==========================================
+# 3. 省份排行榜 (增量维护 TOP N)
+# ==========================================
+TOP_N = 10
+BOARD_COLUMNS = {'zh': ('省份', '新生', '离世'), 'en': ('Province', 'Born', 'Deaths')}
+
+class ProvinceBoard:
+    """各省累计新生/离世计数存为整数数组，随事件到达增量维护 TOP N 排名。"""
+
+    def __init__(self, size=len(PROVINCES), top_n=TOP_N):
+        self.born = np.zeros(size, dtype=np.int64)
+        self.death = np.zeros(size, dtype=np.int64)
+        self.top_n = top_n
+        self.top = self._rank(np.arange(size))
+        self.version = 0  # TOP N 的名次或数值每变化一次加一
+
+    @classmethod
+    def from_counts(cls, born, death):
+        board = cls(len(born))
+        board.born[:], board.death[:] = born, death
+        board.top = board._rank(np.arange(len(born)))
+        return board
+
+    def _rank(self, candidates):
+        # 按总数降序，同分按省份原始顺序，保证排名稳定
+        total = self.born[candidates] + self.death[candidates]
+        return candidates[np.lexsort((candidates, -total))][:self.top_n]
+
+    def add(self, birth_prov=(), death_prov=()):
+        """累加一批事件，返回 TOP N 是否发生变化。"""
+        n = len(self.born)
+        return self.add_counts(*(np.bincount(prov, minlength=n) if len(prov) else None for prov in (birth_prov, death_prov)))
+
+    def add_counts(self, born=None, death=None):
+        """累加各省计数增量 (按省份下标排列的数组)，返回 TOP N 是否发生变化。"""
+        touched = []
+        for counts, delta in ((self.born, born), (self.death, death)):
+            if delta is not None and delta.any():
+                counts += delta
+                touched.append(np.flatnonzero(delta))
+        if not touched:
+            return False
+        touched = np.concatenate(touched)
+        # 计数只增不减：榜外且本批没动过的省份不可能挤进前 N，只需重排旧榜和被触及的省份
+        top = self._rank(np.union1d(self.top, touched))
+        changed = not np.array_equal(top, self.top) or np.isin(touched, top).any()
+        self.top = top
+        if changed:
+            self.version += 1
+        return changed
+
+    def frame(self, language):
+        """当前 TOP N 的展示表 (列名 -> 列) 与两列进度条上限。"""
+        name_col, born_col, death_col = BOARD_COLUMNS[language]
+        born, death = self.born[self.top], self.death[self.top]
+        table = {
+            name_col: [PROV_NAMES[language][i] for i in self.top],
+            born_col: born,
+            death_col: death,
+        }
+        return table, max(int(born.max()), 10), max(int(death.max()), 10)
+
+# ==========================================
+# 3.1 会话状态 (界面和命令行共用的批次记账)
+# ==========================================
+LOG_LEN = 6  # 出生/死亡日志各保留的条数
+BIRTH_COLORS = np.array([[0, 255, 255, 200], [255, 0, 255, 200]], dtype=np.uint8)  # 下标即性别：0 男 1 女
+DEATH_COLOR = np.array([248, 113, 113, 200], dtype=np.uint8)
+BIRTH_SIZE, DEATH_SIZE = 80000, 30000  # 地图标记半径 (米)
+
+class Session:
+    """一个观看者的累计状态：本场总数、最近日志、省级排行和两张地图的标记。
+    引擎批次逐个 apply 进来，标记按时间戳 expire；界面的每个会话和命令行压测都用它。"""
+
+    def __init__(self):
+        self.total_born = 0
+        self.total_death = 0
+        self.born_log = deque(maxlen=LOG_LEN)   # (时间, 省份下标, 性别)，最新的在前
+        self.death_log = deque(maxlen=LOG_LEN)  # (时间, 省份下标)
+        self.board = ProvinceBoard()
+        self.birth_points = PointRing()
+        self.death_points = PointRing()
+
+    @property
+    def rings(self):
+        return self.birth_points, self.death_points
+
+    def apply(self, batch, geo, points=True):
+        """并入一个引擎批次；points 为 False 时只记数字和日志，不落地图标记 (页面隐藏时)。"""
+        birth_prov, birth_gender, death_prov = batch['birth_prov'], batch['birth_gender'], batch['death_prov']
+        self.board.add(birth_prov, death_prov)
+        t_str = datetime.datetime.fromtimestamp(batch['sim_ts']).strftime('%H:%M:%S')
+        if len(birth_prov):
+            self.total_born += len(birth_prov)
+            # 日志只存原始数据，渲染时再套模板；本批只有最后 LOG_LEN 个事件有机会留下
+            for p, g in zip(birth_prov[-LOG_LEN:].tolist(), birth_gender[-LOG_LEN:].tolist()):
+                self.born_log.appendleft((t_str, p, g))
+            if points:
+                place = geo.places(birth_prov)
+                self.birth_points.extend(
+                    geo.lat[place], geo.lon[place], BIRTH_COLORS[birth_gender], BIRTH_SIZE, batch['ts'], birth_prov, place
+                )
+        if len(death_prov):
+            self.total_death += len(death_prov)
+            for p in death_prov[-LOG_LEN:].tolist():
+                self.death_log.appendleft((t_str, p))
+            if points:
+                place = geo.places(death_prov)
+                self.death_points.extend(
+                    geo.lat[place], geo.lon[place], DEATH_COLOR, DEATH_SIZE, batch['ts'], death_prov, place
+                )
+
+    def add_counts(self, born, death):
+        """按各省计数增量一次补齐总数和排行 (跳过了逐条事件，日志和标记不变)。"""
+        self.board.add_counts(born, death)
+        self.total_born += int(born.sum())
+        self.total_death += int(death.sum())
+
+    def expire(self, cutoff):
+        """丢弃时间戳不晚于 cutoff 的地图标记，返回丢弃的条数。"""
+        return sum(ring.expire(cutoff) for ring in self.rings)
+
+# ==========================================
+# 4. 事件抽样与共享引擎
+# ==========================================
+FLUSH_INTERVAL = 1.0     # 后台线程合并落盘 (事件日志、数据库) 的间隔（秒）
+PERSIST_INTERVAL = 10.0  # 引擎把各省当日增量交给写入器的间隔（秒）
+SESSION_TIMEOUT = 30.0   # 超过该秒数没有心跳的会话不再计入在线数
+MAX_CATCHUP_STEPS = 10  # 后台线程落后时一次最多补跑的步数，再多就顺延模拟时钟
+EVENT_HISTORY = 64  # 引擎保留的最近批次数，供慢一拍的会话追赶；落后更多的按累计计数补齐，见 missed_counts
+
+class EventSampler:
+    """泊松事件抽样：各省独立的泊松过程等价于先按总强度抽总数，再按强度占比分配省份；
+    累积分布只在构造时算一次，之后每步一次 poisson 加一次 searchsorted。"""
+
+    def __init__(self, birth_rates, death_rates, seed=None):
+        self.rng = np.random.default_rng(seed)
+        self.birth_rate, self.birth_cdf = self._cdf(birth_rates)
+        self.death_rate, self.death_cdf = self._cdf(death_rates)
+
+    @staticmethod
+    def _cdf(rates):
+        cdf = np.cumsum(np.asarray(rates, dtype=np.float64))
+        return cdf[-1], cdf / cdf[-1]
+
+    def _provinces(self, cdf, n):
+        return np.searchsorted(cdf, self.rng.random(n), side='right').astype(np.int16)
+
+    def births(self, dt):
+        """dt 模拟秒内的出生事件，返回 (省份下标, 性别) 两个等长数组。"""
+        n = self.rng.poisson(self.birth_rate * dt)
+        return self._provinces(self.birth_cdf, n), self.rng.integers(0, 2, size=n, dtype=np.uint8)
+
+    def deaths(self, dt):
+        return self._provinces(self.death_cdf, self.rng.poisson(self.death_rate * dt))
+
+class LifeEngine:
+    """进程级事件引擎：后台线程统一生成出生/死亡事件，各会话只订阅和渲染。
+    每步固定推进 tick * time_scale 模拟秒，事件流只取决于种子和步数，与线程何时被调度无关。
+    给了选举锁时只有领导者进程生成事件，跟随进程每步改为转发事件日志里新写入的事件。"""
+
+    def __init__(self, tick, seed=None, time_scale=1, writer=None, event_log=None, metrics=None,
+                 leader=None, counters=None):
+        self.tick = tick
+        self.time_scale = time_scale
+        self.sim_dt = tick * time_scale
+        self.sim_start = time.time()
+        self.steps = 0
+        self.metrics = metrics
+        self.labels = {'scale': str(time_scale)}
+        self.sampler = EventSampler(PROV_BIRTH_RATE, PROV_DEATH_RATE, seed)
+        self.writer = writer
+        self.event_log = event_log
+        self.day = None
+        self.day_born = np.zeros(len(PROVINCES), dtype=np.int64)
+        self.day_death = np.zeros(len(PROVINCES), dtype=np.int64)
+        self.persisted_at = 0.0
+        self.leader = leader
+        self.counters = counters
+        self.following = leader is not None and not leader.acquire()
+        self.tail = event_log.tail_start() if self.following else None
+        self.elect_at = time.monotonic() + LEADER_RETRY
+        if counters is not None and not self.following:
+            counters.repair()
+        self.sessions = {}  # 会话 id -> 最后一次活动时间
+        self.seq = 0
+        self.born = np.zeros(len(PROVINCES), dtype=np.int64)   # 启动以来各省累计，供暂停的会话按差值追赶
+        self.death = np.zeros(len(PROVINCES), dtype=np.int64)
+        self.batches = deque(maxlen=EVENT_HISTORY)
+        self.cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="life-engine", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        next_at = time.monotonic()
+        while True:
+            self._elect()
+            # 不负责持久化的加速引擎没人看时暂停，模拟时钟随之停住；1× 的模拟时间就是真实时间，从不暂停
+            if self.writer is None and self.time_scale != 1 and not self.active_sessions():
+                time.sleep(self.tick)
+                next_at = time.monotonic()
+                continue
+            # 按固定步长补齐落后的步数；落后太多就丢掉积压，加速引擎的模拟时钟整体顺延
+            due = int((time.monotonic() - next_at) // self.tick) + 1
+            if due > MAX_CATCHUP_STEPS:
+                if self.metrics:
+                    self.metrics.inc('engine_steps_skipped_total', due - MAX_CATCHUP_STEPS, **self.labels)
+                next_at += (due - MAX_CATCHUP_STEPS) * self.tick
+                due = MAX_CATCHUP_STEPS
+                if self.time_scale == 1:
+                    # 1× 的模拟时间就是真实时间 (事件日志按小时分块、跟随进程按真实时间找块、当日计数按日期切换)，
+                    # 丢掉的步数不能让它从此落后：重新对齐，补跑的最后一步落在当前时刻
+                    self.sim_start = time.time() - (self.steps + due) * self.sim_dt
+            for _ in range(due):
+                self.step(time.time())
+            next_at += due * self.tick
+            time.sleep(max(next_at - time.monotonic(), 0.0))
+
+    def _elect(self):
+        """跟随进程每隔 LEADER_RETRY 秒尝试接任；模拟时钟从当前真实时间接着走。"""
+        if not self.following or time.monotonic() < self.elect_at:
+            return
+        self.elect_at = time.monotonic() + LEADER_RETRY
+        if self.leader.acquire():
+            self.following = False
+            self.sim_start = time.time() - self.steps * self.sim_dt
+            if self.counters is not None:
+                self.counters.repair()
+            if self.metrics:
+                self.metrics.inc('leader_elections_total')
+
+    def _follow(self):
+        """跟随进程的一步：领导者写进事件日志的新事件，按引擎批次的格式拆开。"""
+        records, self.tail = self.event_log.tail(self.tail)
+        births = records['kind'] != EVENT_DEATH
+        sim_ts = float(records['ts'][-1]) if len(records) else self.sim_start + self.steps * self.sim_dt
+        return sim_ts, records['prov'][births], records['kind'][births], records['prov'][~births]
+
+    def step(self, ts):
+        started = time.perf_counter()
+        self.steps += 1
+        if self.following:
+            sim_ts, birth_prov, birth_gender, death_prov = self._follow()
+        else:
+            sim_ts = self.sim_start + self.steps * self.sim_dt
+            birth_prov, birth_gender = self.sampler.births(self.sim_dt)
+            death_prov = self.sampler.deaths(self.sim_dt)
+            if self.writer is not None:
+                self._accumulate(ts, birth_prov, death_prov)
+            if self.event_log is not None:
+                self.event_log.append(sim_ts, birth_prov, birth_gender, death_prov)
+            if self.counters is not None:
+                self.counters.add(sim_ts, birth_prov, death_prov)
+        if self.metrics and self.leader is not None:
+            self.metrics.set('engine_leader', 0 if self.following else 1)
+        if not len(birth_prov) and not len(death_prov):
+            # 空批次不唤醒订阅者，没有变化的会话就不用醒来
+            return
+        with self.cond:
+            self.seq += 1
+            self.born += np.bincount(birth_prov, minlength=len(self.born))
+            self.death += np.bincount(death_prov, minlength=len(self.death))
+            self.batches.append({
+                "seq": self.seq, "ts": ts, "sim_ts": sim_ts,
+                "birth_prov": birth_prov, "birth_gender": birth_gender, "death_prov": death_prov,
+                "born_total": self.born.copy(), "death_total": self.death.copy(),  # 本批之后的各省累计
+            })
+            self.cond.notify_all()
+        if self.metrics:
+            self.metrics.observe('engine_step_seconds', time.perf_counter() - started, **self.labels)
+            self.metrics.inc('events_total', len(birth_prov), kind='birth', **self.labels)
+            self.metrics.inc('events_total', len(death_prov), kind='death', **self.labels)
+
+    def _accumulate(self, ts, birth_prov, death_prov):
+        """累计当日各省增量，每 PERSIST_INTERVAL 秒或跨天时批量交给写入器。"""
+        day = datetime.date.fromtimestamp(ts).isoformat()
+        if day != self.day:
+            self.persist()
+            self.day = day
+        self.day_born += np.bincount(birth_prov, minlength=len(PROVINCES))
+        self.day_death += np.bincount(death_prov, minlength=len(PROVINCES))
+        if ts - self.persisted_at >= PERSIST_INTERVAL:
+            self.persist()
+            self.persisted_at = ts
+
+    def persist(self):
+        if self.day_born.any() or self.day_death.any():
+            self.writer.add_province_counts(self.day, self.day_born.copy(), self.day_death.copy())
+            self.day_born[:] = 0
+            self.day_death[:] = 0
+
+    def touch(self, session_id):
+        self.sessions[session_id] = time.time()
+
+    def active_sessions(self):
+        cutoff = time.time() - SESSION_TIMEOUT
+        for sid, seen in list(self.sessions.items()):
+            if seen < cutoff:
+                self.sessions.pop(sid, None)
+        return len(self.sessions)
+
+    def events_since(self, cursor):
+        """返回 cursor 之后还保留着的批次以及新的 cursor；落后超过 EVENT_HISTORY 批时开头有缺口，见 missed_counts。"""
+        with self.cond:
+            return [b for b in self.batches if b["seq"] > cursor], self.seq
+
+    def counts(self):
+        """(seq, 各省累计新生, 各省累计离世)，三者取自同一时刻。"""
+        with self.cond:
+            return self.seq, self.born.copy(), self.death.copy()
+
+    def snapshot(self):
+        """模拟时钟和随机数状态；新进程里的同倍速引擎 restore 之后接着同一条事件流走。"""
+        return {
+            'steps': self.steps,
+            'sim_ts': self.sim_start + self.steps * self.sim_dt,
+            'rng': self.sampler.rng.bit_generator.state,
+        }
+
+    def restore(self, state):
+        """在 start 之前调用。"""
+        self.steps = state['steps']
+        self.sim_start = state['sim_ts'] - self.steps * self.sim_dt
+        self.sampler.rng.bit_generator.state = state['rng']
+
+    def wait(self, cursor, timeout):
+        """阻塞到有新批次或超时，替代每个会话各自的 time.sleep。"""
+        with self.cond:
+            self.cond.wait_for(lambda: self.seq > cursor, timeout)
+
+def missed_counts(batches, cursor, totals):
+    """cursor 和最早保留的批次之间被挤出历史的那些批次的各省计数 (新生, 离世)，没有缺口时为 None。
+    totals 是引擎在 cursor 处的各省累计 (born, death)；批次不带累计 (回放) 或不知道 totals 时无从补齐，也为 None。"""
+    if not batches or batches[0]["seq"] <= cursor + 1 or totals is None or "born_total" not in batches[0]:
+        return None
+    first = batches[0]
+    born = first["born_total"] - np.bincount(first["birth_prov"], minlength=len(PROVINCES)) - totals[0]
+    death = first["death_total"] - np.bincount(first["death_prov"], minlength=len(PROVINCES)) - totals[1]
+    return born, death
+
+# ==========================================
+# 5. 事件日志 (追加写入的二进制文件，按小时分块，内存映射读取)
+# ==========================================
+EVENT_DTYPE = np.dtype([('ts', '<f8'), ('prov', '<i2'), ('kind', 'u1')])  # kind: 0 男孩 / 1 女孩 / 2 离世
+EVENT_DEATH = 2
+CHUNK_SECONDS = 3600  # 每个文件覆盖的时间跨度 (按 UTC 整点切分)
+TAIL_GRACE = 3 * FLUSH_INTERVAL  # 跟读时整点过后再等多久才认为上一小时的文件已写完
+
+class EventLog:
+    """每个事件一条 11 字节的定长记录，按小时追加到 events-YYYYMMDD-HH.bin。
+    文件没有表头，可直接 np.fromfile / np.memmap 读取；文件内按时间有序，查找用 searchsorted。"""
+
+    def __init__(self, root, metrics=None):
+        self.root = root
+        self.metrics = metrics
+        self.pending = []
+        self.errors = 0
+        self.lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name="event-log", daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def chunk_path(self, hour):
+        stamp = datetime.datetime.fromtimestamp(hour * CHUNK_SECONDS, datetime.timezone.utc).strftime('%Y%m%d-%H')
+        return os.path.join(self.root, f"events-{stamp}.bin")
+
+    def append(self, ts, birth_prov, birth_gender, death_prov):
+        """入队一步的事件，由后台线程批量落盘。"""
+        n_birth, n = len(birth_prov), len(birth_prov) + len(death_prov)
+        if n == 0:
+            return
+        records = np.empty(n, dtype=EVENT_DTYPE)
+        records['ts'] = ts
+        records['prov'][:n_birth], records['prov'][n_birth:] = birth_prov, death_prov
+        records['kind'][:n_birth], records['kind'][n_birth:] = birth_gender, EVENT_DEATH
+        with self.lock:
+            self.pending.append(records)
+
+    def _run(self):
+        while True:
+            time.sleep(FLUSH_INTERVAL)
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            if not self.pending:
+                return
+            records, self.pending = np.concatenate(self.pending), []
+        started = time.perf_counter()
+        hours = (records['ts'] // CHUNK_SECONDS).astype(np.int64)
+        # 记录按时间有序，同一小时的记录是连续的一段
+        bounds = np.flatnonzero(np.diff(hours)) + 1
+        for part in np.split(records, bounds):
+            try:
+                with open(self.chunk_path(int(part['ts'][0] // CHUNK_SECONDS)), 'ab') as f:
+                    f.write(part.tobytes())
+            except OSError:
+                self.errors += 1
+                if self.metrics:
+                    self.metrics.inc('event_log_errors_total')
+        if self.metrics:
+            self.metrics.observe('event_log_flush_seconds', time.perf_counter() - started)
+
+    def read(self, start, end):
+        """时间落在 (start, end] 内的全部事件；只映射涉及的小时文件，只复制命中的一段。"""
+        parts = []
+        for hour in range(int(start // CHUNK_SECONDS), int(end // CHUNK_SECONDS) + 1):
+            path = self.chunk_path(hour)
+            try:
+                count = os.path.getsize(path) // EVENT_DTYPE.itemsize  # 忽略写到一半的尾部记录
+            except OSError:
+                continue
+            if count == 0:
+                continue
+            chunk = np.memmap(path, dtype=EVENT_DTYPE, mode='r', shape=(count,))
+            lo, hi = np.searchsorted(chunk['ts'], [start, end], side='right')
+            if hi > lo:
+                parts.append(np.array(chunk[lo:hi]))
+        return np.concatenate(parts) if parts else np.empty(0, dtype=EVENT_DTYPE)
+
+    def tail_start(self):
+        """跟读的起点：当前小时文件的末尾，只转发之后新写入的事件。"""
+        hour = int(time.time() // CHUNK_SECONDS)
+        try:
+            return hour, os.path.getsize(self.chunk_path(hour)) // EVENT_DTYPE.itemsize
+        except OSError:
+            return hour, 0
+
+    def tail(self, cursor):
+        """读取 cursor = (小时, 已读条数) 之后新追加的完整记录，返回 (记录, 新 cursor)。
+        上一小时的文件要等领导者最后一次落盘之后 (TAIL_GRACE 秒) 才翻到下一个文件。"""
+        hour, offset = cursor
+        last = int((time.time() - TAIL_GRACE) // CHUNK_SECONDS)
+        parts = []
+        while True:
+            path = self.chunk_path(hour)
+            try:
+                count = os.path.getsize(path) // EVENT_DTYPE.itemsize
+            except OSError:
+                count = 0
+            if count > offset:
+                parts.append(np.fromfile(path, dtype=EVENT_DTYPE, count=count - offset, offset=offset * EVENT_DTYPE.itemsize))
+                offset = count
+            if hour >= last:
+                break
+            hour, offset = hour + 1, 0
+        records = np.concatenate(parts) if parts else np.empty(0, dtype=EVENT_DTYPE)
+        return records, (hour, offset)
+
+# ==========================================
+# 6. 同一主机多进程共享 (选举锁 + 共享计数)
+# ==========================================
+LEADER_RETRY = 1.0      # 跟随进程尝试接任领导者的间隔（秒）
+SNAPSHOT_RETRIES = 100  # 读快照时遇到正在写入最多重试的次数
+
+class LeaderLock:
+    """flock 选举锁：拿到锁的进程是领导者；进程退出 (包括崩溃) 时锁由系统释放，其他进程即可接任。"""
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = None
+
+    @property
+    def held(self):
+        return self.fd is not None
+
+    def acquire(self):
+        """非阻塞地尝试拿锁，已经持有时直接返回 True。"""
+        if self.fd is not None:
+            return True
+        if fcntl is None:
+            self.fd = -1
+            return True
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        # 锁文件里记下领导者的 pid，方便排查
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())
+        self.fd = fd
+        return True
+
+class SharedCounters:
+    """当日计数的内存映射 int64 数组：[版本, 日期序号, 新生合计, 离世合计, 各省新生..., 各省离世...]。
+    只有领导者写；写前写后版本号各加一 (奇数表示正在写)，读者比较前后版本号拿到一致的快照，读不加锁。"""
+
+    HEADER = 4
+
+    def __init__(self, path, n):
+        self.n = n
+        size = (self.HEADER + 2 * n) * 8
+        with open(path, 'a+b') as f:
+            if os.fstat(f.fileno()).st_size != size:
+                # 新文件或省份数变了：清零重建
+                f.truncate(0)
+                f.truncate(size)
+        self.data = np.memmap(path, dtype=np.int64, mode='r+', shape=(self.HEADER + 2 * n,))
+
+    def repair(self):
+        """接任领导者时调用：上一任若在写到一半时退出，版本号停在奇数，补成偶数。"""
+        if self.data[0] % 2:
+            self.data[0] += 1
+
+    def add(self, ts, birth_prov, death_prov):
+        d, n = self.data, self.n
+        day = datetime.date.fromtimestamp(ts).toordinal()
+        d[0] += 1
+        if d[1] != day:
+            d[1:] = 0
+            d[1] = day
+        d[2] += len(birth_prov)
+        d[3] += len(death_prov)
+        d[self.HEADER:self.HEADER + n] += np.bincount(birth_prov, minlength=n)
+        d[self.HEADER + n:] += np.bincount(death_prov, minlength=n)
+        d[0] += 1
+
+    def snapshot(self):
+        """(新生合计, 离世合计, 各省新生, 各省离世)；计数不是今天的 (领导者停了一天以上) 视为零。"""
+        d = self.data
+        for _ in range(SNAPSHOT_RETRIES):
+            version = d[0]
+            if version % 2 == 0:
+                snap = np.array(d)
+                if d[0] == version:
+                    break
+        else:
+            snap = np.array(d)
+        n, h = self.n, self.HEADER
+        if snap[1] != datetime.date.today().toordinal():
+            snap[2:] = 0
+        return int(snap[2]), int(snap[3]), snap[h:h + n], snap[h + n:]
+
+# ==========================================
+# 6.1 状态快照 (断线重连、服务重启后接着显示)
+# ==========================================
+SNAPSHOT_MAGIC = b'BBS1'
+SNAPSHOT_PRUNE_INTERVAL = 600.0  # 运行中清理过期快照的最短间隔（秒），由保存顺带触发
+
+def pack_snapshot(meta, arrays):
+    """紧凑的二进制快照：魔数 + 头长度 + JSON 头 (标量和各数组的类型、形状) + 各数组的原始字节。"""
+    layout, offset = [], 0
+    for name, arr in arrays.items():
+        layout.append((name, arr.dtype.str, arr.shape, offset))
+        offset += arr.nbytes
+    header = json.dumps({'meta': meta, 'arrays': layout}, separators=(',', ':'), ensure_ascii=False).encode()
+    parts = [SNAPSHOT_MAGIC, struct.pack('<I', len(header)), header]
+    parts += [np.ascontiguousarray(arr).tobytes() for arr in arrays.values()]
+    return b''.join(parts)
+
+def unpack_snapshot(blob):
+    """返回 (meta, 数组字典)；数组是各自的可写副本。格式不对时抛 ValueError。"""
+    if blob[:4] != SNAPSHOT_MAGIC or len(blob) < 8:
+        raise ValueError("not a snapshot")
+    (size,) = struct.unpack_from('<I', blob, 4)
+    header = json.loads(blob[8:8 + size])
+    body = memoryview(blob)[8 + size:]
+    arrays = {}
+    for name, dtype, shape, offset in header['arrays']:
+        dtype = np.dtype(dtype)
+        count = int(np.prod(shape))
+        arrays[name] = np.frombuffer(body, dtype, count, offset).reshape(shape).copy()
+    return header['meta'], arrays
+
+class SnapshotStore:
+    """按令牌存取快照文件。先写临时文件再改名，读到的总是完整的一份；太旧的快照视为不存在。"""
+
+    def __init__(self, root, ttl, prune_interval=SNAPSHOT_PRUNE_INTERVAL):
+        self.root = root
+        self.ttl = ttl
+        self.prune_interval = prune_interval
+        self.pruned_at = 0.0
+        self.saved = {}  # 令牌 -> 本进程最后一次保存的时间
+        os.makedirs(root, exist_ok=True)
+        self.prune()
+
+    def path(self, token):
+        return os.path.join(self.root, f"{token}.snap")
+
+    def save(self, token, blob):
+        path = self.path(token)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(blob)
+        os.replace(tmp, path)
+        self.saved[token] = time.time()
+        if self.saved[token] - self.pruned_at >= self.prune_interval:
+            self.prune()  # 长时间运行的进程里，访客离开后留下的快照也要按 ttl 清掉
+
+    def age(self, token):
+        """距本进程上次保存该令牌过了多少秒，没保存过为无穷大。"""
+        return time.time() - self.saved.get(token, float('-inf'))
+
+    def load(self, token):
+        path = self.path(token)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                return None
+            with open(path, 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def discard(self, token):
+        self.saved.pop(token, None)
+        try:
+            os.remove(self.path(token))
+        except OSError:
+            pass
+
+    def prune(self):
+        """删掉超过 ttl 没更新的快照和写到一半留下的临时文件。"""
+        self.pruned_at = time.time()
+        cutoff = self.pruned_at - self.ttl
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
+
+# ==========================================
+# 6.2 事件流接口 (NDJSON / SSE，供看板和测试直接订阅)
+# ==========================================
+STREAM_QUEUE = 64          # 每个订阅者最多积压的批次数，满了说明消费太慢，直接断开
+STREAM_KEEPALIVE = 15.0    # 没有事件时发保活行的间隔（秒），顺便发现已断开的连接
+STREAM_WRITE_TIMEOUT = 30.0  # 单次写入卡住超过该秒数 (对方不读) 就断开
+STREAM_MAX_CLIENTS = 64
+STREAM_GENDERS = ('male', 'female')  # 按引擎的性别编码：0 男孩 / 1 女孩
+STREAM_PROV_JSON = [json.dumps(name, ensure_ascii=False) for name in PROV_NAMES['zh']]
+# 格式 -> (Content-Type, 保活内容)；NDJSON 消费方按惯例跳过空行
+STREAM_FORMATS = {
+    'ndjson': ('application/x-ndjson; charset=utf-8', b'\n'),
+    'sse': ('text/event-stream; charset=utf-8', b': keepalive\n\n'),
+}
+
+def encode_events(batch):
+    """一个批次的事件逐条编码成 JSON 字符串：出生在前、离世在后，同一批次共用模拟时间戳。"""
+    ts = round(float(batch['sim_ts']), 3)
+    lines = [
+        f'{{"ts":{ts},"kind":"birth","prov":{STREAM_PROV_JSON[p]},"gender":"{STREAM_GENDERS[g]}"}}'
+        for p, g in zip(batch['birth_prov'].tolist(), batch['birth_gender'].tolist())
+    ]
+    lines += [f'{{"ts":{ts},"kind":"death","prov":{STREAM_PROV_JSON[p]},"gender":null}}' for p in batch['death_prov'].tolist()]
+    return lines
+
+def encode_payload(fmt, seq, lines):
+    """一个批次一次写出：NDJSON 每个事件一行；SSE 每个批次一条消息，data 为事件数组，id 为批次序号。"""
+    if fmt == 'sse':
+        return f'id: {seq}\nevent: batch\ndata: [{",".join(lines)}]\n\n'.encode()
+    return ''.join(f'{line}\n' for line in lines).encode()
+
+class Subscriber:
+    def __init__(self, fmt):
+        self.fmt = fmt
+        self.queue = queue.Queue(STREAM_QUEUE)
+        self.dropped = False
+
+class EventHub:
+    """把一个引擎的批次分发给多个订阅者：后台线程每个批次只取一次、每种格式只编码一次，
+    再放进各订阅者自己的有界队列。队列满 (消费太慢) 的订阅者直接断开，不替它无限缓存。"""
+
+    def __init__(self, engine, metrics=None):
+        self.engine = engine
+        self.metrics = metrics
+        self.lock = threading.Lock()
+        self.subscribers = set()
+        self.cursor = engine.seq
+        self._thread = threading.Thread(target=self._run, name="event-hub", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def subscribe(self, fmt):
+        """新订阅者从下一个批次开始收；人数已满时返回 None。"""
+        with self.lock:
+            if len(self.subscribers) >= STREAM_MAX_CLIENTS:
+                return None
+            sub = Subscriber(fmt)
+            self.subscribers.add(sub)
+        # 订阅者也算在线会话：没人看就暂停的引擎要为它接着走
+        self.engine.touch('event-stream')
+        self._gauge()
+        return sub
+
+    def unsubscribe(self, sub):
+        with self.lock:
+            self.subscribers.discard(sub)
+        self._gauge()
+
+    def _gauge(self):
+        if self.metrics:
+            self.metrics.set('stream_subscribers', len(self.subscribers))
+
+    def _run(self):
+        while True:
+            self.engine.wait(self.cursor, STREAM_KEEPALIVE)
+            batches, self.cursor = self.engine.events_since(self.cursor)
+            with self.lock:
+                subscribers = list(self.subscribers)
+            if not subscribers:
+                continue
+            self.engine.touch('event-stream')
+            for batch in batches:
+                self.publish(batch, subscribers)
+
+    def publish(self, batch, subscribers):
+        lines = encode_events(batch)
+        payloads = {}
+        for sub in subscribers:
+            if sub.dropped:
+                continue
+            if sub.fmt not in payloads:
+                payloads[sub.fmt] = encode_payload(sub.fmt, batch['seq'], lines)
+            try:
+                sub.queue.put_nowait(payloads[sub.fmt])
+            except queue.Full:
+                sub.dropped = True
+                self.unsubscribe(sub)
+                if self.metrics:
+                    self.metrics.inc('stream_dropped_total')
+        if self.metrics:
+            self.metrics.inc('stream_events_total', len(lines))
+
+class StreamHandler(BaseHTTPRequestHandler):
+    """GET /events 持续输出事件：默认 NDJSON，?format=sse 或 Accept: text/event-stream 时为 SSE；
+    GET /health 返回当前订阅数和引擎批次序号。"""
+
+    timeout = STREAM_WRITE_TIMEOUT
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        hub = self.server.hub
+        if url.path == '/health':
+            body = json.dumps({'subscribers': len(hub.subscribers), 'seq': hub.engine.seq}).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        if url.path != '/events':
+            self.send_error(404)
+            return
+        fmt = parse_qs(url.query).get('format', [None])[0]
+        if fmt is None:
+            fmt = 'sse' if 'text/event-stream' in self.headers.get('Accept', '') else 'ndjson'
+        if fmt not in STREAM_FORMATS:
+            self.send_error(400, f"format must be one of {', '.join(STREAM_FORMATS)}")
+            return
+        sub = hub.subscribe(fmt)
+        if sub is None:
+            self.send_error(503, "too many subscribers")
+            return
+        content_type, keepalive = STREAM_FORMATS[fmt]
+        try:
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Cache-Control', 'no-cache')
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+            self.wfile.flush()
+            while not sub.dropped:
+                try:
+                    payload = sub.queue.get(timeout=STREAM_KEEPALIVE)
+                except queue.Empty:
+                    payload = keepalive
+                self.wfile.write(payload)
+                self.wfile.flush()
+        except OSError:
+            pass  # 对方断开或写入超时
+        finally:
+            hub.unsubscribe(sub)
+
+    def log_message(self, format, *args):
+        pass
+
+class StreamServer(ThreadingHTTPServer):
+    """每个连接一个线程的事件流服务；端口被占用时构造即抛 OSError。"""
+
+    daemon_threads = True
+
+    def __init__(self, address, hub):
+        super().__init__(address, StreamHandler)
+        self.hub = hub
+
+    def start(self):
+        self.hub.start()
+        threading.Thread(target=self.serve_forever, name="event-stream", daemon=True).start()
+        return self
+
+# ==========================================
+# 7. 命令行：不渲染，尽快跑完 N 模拟秒
+# ==========================================
+def simulate(seconds, tick=0.8, seed=None):
+    """同步驱动引擎跑完 seconds 模拟秒：像界面的一个会话那样把批次并入 Session (排行榜、日志、区县级地图点)，
+    并按模拟时间过期标记。返回 (引擎, 会话, 墙钟耗时)。"""
+    engine = LifeEngine(tick, seed)
+    session = Session()
+    geo = Geography(PLACE_FILE, seed)
+    cursor = 0
+    started = time.perf_counter()
+    for _ in range(int(np.ceil(seconds / tick))):
+        ts = engine.sim_start + (engine.steps + 1) * engine.sim_dt
+        engine.step(ts)
+        batches, cursor = engine.events_since(cursor)
+        for batch in batches:
+            session.apply(batch, geo)
+        session.expire(ts - POINT_TTL)
+    return engine, session, time.perf_counter() - started
+
+def distribution_error(counts, rates, seconds):
+    """观测到的各省占比相对强度占比的误差：最大绝对误差、总变差距离和卡方统计量 (自由度为省份数减一)。"""
+    total = int(counts.sum())
+    share = rates / rates.sum()
+    observed = counts / max(total, 1)
+    expected = share * total
+    worst = int(np.argmax(np.abs(observed - share)))
+    return {
+        "events": total,
+        "expected_events": round(float(rates.sum() * seconds), 1),
+        "max_abs_error": round(float(np.abs(observed - share).max()), 6),
+        "worst_province": PROVINCES[worst]['en'],
+        "tv_distance": round(float(np.abs(observed - share).sum() / 2), 6),
+        "chi2": round(float(((counts - expected) ** 2 / expected).sum()), 2) if total else 0.0,
+        "dof": len(rates) - 1,
+    }
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    # ru_maxrss 在 Linux 上是 KB，在 macOS 上是字节
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024, 1)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="不渲染地运行模拟引擎，报告吞吐、内存和各省分布误差")
+    parser.add_argument("--seconds", type=float, default=86400, help="模拟秒数")
+    parser.add_argument("--tick", type=float, default=0.8, help="每步推进的模拟秒数 (界面每帧 0.8 秒)")
+    parser.add_argument("--seed", type=int, help="随机种子，固定后事件流可复现")
+    parser.add_argument("--trace-alloc", action="store_true", help="用 tracemalloc 统计分配峰值 (计时会变慢)")
+    parser.add_argument("--serve", type=int, metavar="PORT", help="不跑压测，按真实时间运行引擎并在该端口输出事件流")
+    parser.add_argument("--host", default="127.0.0.1", help="事件流监听的地址")
+    parser.add_argument("--time-scale", type=int, default=1, help="事件流的模拟时间加速倍数")
+    args = parser.parse_args(argv)
+
+    if args.serve is not None:
+        engine = LifeEngine(args.tick, args.seed, args.time_scale).start()
+        server = StreamServer((args.host, args.serve), EventHub(engine))
+        server.hub.start()
+        print(f"streaming on http://{args.host}:{server.server_address[1]}/events", file=sys.stderr)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        return
+
+    if args.trace_alloc:
+        import tracemalloc
+        tracemalloc.start()
+    engine, session, wall = simulate(args.seconds, args.tick, args.seed)
+    board = session.board
+    events = int(board.born.sum() + board.death.sum())
+    result = {
+        "sim_seconds": args.seconds,
+        "tick": args.tick,
+        "steps": engine.steps,
+        "seed": args.seed,
+        "wall_s": round(wall, 3),
+        "events": events,
+        "events_per_s": round(events / wall) if wall else None,
+        "sim_speedup": round(args.seconds / wall) if wall else None,
+        "peak_rss_mb": peak_rss_mb(),
+        "births": distribution_error(board.born, PROV_BIRTH_RATE, args.seconds),
+        "deaths": distribution_error(board.death, PROV_DEATH_RATE, args.seconds),
+    }
+    if args.trace_alloc:
+        result["alloc_peak_mb"] = round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 3)
+        tracemalloc.stop()
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
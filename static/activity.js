@@ -0,0 +1,46 @@
+// 页面状态上报：activity 为 hidden 隐藏 / idle 超过 idle_after 秒没有键鼠/触摸操作 / active，只在变化时上报。
+// 浏览器端地图 (live_map.js) 直接调用 watchActivity；pydeck 渲染时页面上没有它，
+// 由默认导出的探针组件上报：不显示任何内容，data 为 {idle_after} (UTF-8 JSON 字节)。
+const ACTIVITY_CHECK = 15000;  // 检查是否闲置的间隔 (毫秒)
+const INPUT_EVENTS = ["pointerdown", "pointermove", "keydown", "wheel", "touchstart"];
+
+// state.setStateValue 每次渲染都换成最新的；返回停止监听的函数
+export function watchActivity(state, idleAfter) {
+  let lastInput = performance.now();
+  let reported = "active";
+  const report = () => {
+    const activity = document.hidden ? "hidden" : performance.now() - lastInput > idleAfter ? "idle" : "active";
+    if (activity !== reported) {
+      reported = activity;
+      state.setStateValue("activity", activity);
+    }
+  };
+  const abort = new AbortController();
+  const onInput = () => {
+    lastInput = performance.now();
+    if (reported === "idle") report();
+  };
+  for (const type of INPUT_EVENTS) window.addEventListener(type, onInput, { passive: true, signal: abort.signal });
+  document.addEventListener("visibilitychange", report, { signal: abort.signal });
+  const timer = setInterval(report, ACTIVITY_CHECK);
+  report();
+  return () => {
+    abort.abort();
+    clearInterval(timer);
+  };
+}
+
+export default function (component) {
+  const { parentElement } = component;
+  if (!component.data) return;
+  const state = parentElement.__activity || (parentElement.__activity = { watch: null });
+  state.setStateValue = component.setStateValue;
+  if (!state.watch) {
+    const data = JSON.parse(new TextDecoder().decode(component.data));
+    state.watch = watchActivity(state, data.idle_after * 1000);
+  }
+  return () => {
+    state.watch?.();
+    delete parentElement.__activity;
+  };
+}
@@ -0,0 +1,166 @@
+// 实时地图组件：事件只随新批次下发一次，长大、淡出和过期都在浏览器里按时间逐帧计算。
+// 服务端每次下发的 data (UTF-8 JSON 字节)：
+//   {now, ttl, delay, view: {latitude, longitude, zoom, pitch}, labels, points: [[lon, lat, r, g, b, a, size, age, name], ...]}
+// now 兼作批次号：重跑时重复下发的同一份 data 会被忽略。
+// 服务端每 delay 秒才送来一批，标记统一顺延 delay 秒播放：按原来的先后逐个出现，每个都有完整的 ttl。
+// 带 idle_after (秒) 的那张地图负责上报页面状态 activity：hidden 隐藏 / idle 久无操作 / active，只在变化时上报。
+// 拖动、缩放停下 VIEW_SETTLE 毫秒后上报视角 view：服务端存下它，之后按它裁剪标记、选细节层级。
+import { watchActivity } from "./activity.js";
+
+const DECK_URL = "app/static/vendor/deck.gl-9.3.6.js";  // 随仓库提供的固定版本，与 streamlit_app.DECK_BUNDLE 一致
+const TILE_URL = "https://basemaps.cartocdn.com/dark_all/{z}/{x}/{y}.png";
+const GROW = 0.15;   // 前 15% 的寿命从小长到正常大小
+const FADE = 0.5;    // 后 50% 的寿命逐渐淡出
+const FPS = 30;
+const VIEW_SETTLE = 400;  // 视角停止变化多久后上报 (毫秒)；拖动过程中不上报，免得每一帧都让片段重跑
+const CONTROLLER = { dragRotate: false, touchRotate: false, keyboard: false };
+
+function loadDeck() {
+  if (!window.__baobeiDeck) {
+    window.__baobeiDeck = new Promise((resolve, reject) => {
+      if (window.deck) return resolve(window.deck);
+      const script = document.createElement("script");
+      script.src = DECK_URL;
+      script.onload = () => resolve(window.deck);
+      script.onerror = () => reject(new Error(`Failed to load ${DECK_URL}`));
+      document.head.appendChild(script);
+    });
+  }
+  return window.__baobeiDeck;
+}
+
+function basemap(deck) {
+  return new deck.TileLayer({
+    id: "basemap",
+    data: TILE_URL,
+    minZoom: 0,
+    maxZoom: 19,
+    tileSize: 256,
+    renderSubLayers: (props) => {
+      const [[west, south], [east, north]] = props.tile.boundingBox;
+      return new deck.BitmapLayer(props, { data: null, image: props.data, bounds: [west, south, east, north] });
+    },
+  });
+}
+
+function createState(parentElement) {
+  const host = document.createElement("div");
+  host.style.cssText = "position:relative;width:100%;height:500px;border-radius:12px;overflow:hidden;";
+  parentElement.appendChild(host);
+  return {
+    host, deck: null, points: [], lastNow: 0, view: null, reported: null, settle: null,
+    timer: null, ttl: 3000, delay: 0, labels: 31, watch: null,
+  };
+}
+
+// 上报的精度：经纬度千分之一度、缩放百分之一级，更小的挪动不值得让服务端重跑
+function roundView({ latitude, longitude, zoom, pitch }) {
+  const round = (x, digits) => Math.round(x * 10 ** digits) / 10 ** digits;
+  return { latitude: round(latitude, 3), longitude: round(longitude, 3), zoom: round(zoom, 2), pitch: round(pitch, 1) };
+}
+
+function sameView(a, b) {
+  return !!a && !!b && ["latitude", "longitude", "zoom", "pitch"].every((k) => a[k] === b[k]);
+}
+
+// 视角变化停下来之后上报一次；服务端下发的视野切换 (过渡动画的终点) 和已上报过的视角不再上报
+function onViewStateChange(state, { viewState }) {
+  clearTimeout(state.settle);
+  state.settle = setTimeout(() => {
+    const view = roundView(viewState);
+    if (sameView(view, state.view) || sameView(view, state.reported)) return;
+    state.reported = view;
+    state.setStateValue("view", view);
+  }, VIEW_SETTLE);
+}
+
+function layers(deck, state, now) {
+  const ttl = state.ttl;
+  const live = state.points.filter((p) => p.born <= now);  // 还没轮到的标记先不画
+  const scale = (p) => Math.min(1, 0.3 + (0.7 * (now - p.born)) / (ttl * GROW));
+  const alpha = (p) => Math.max(0, Math.min(1, (p.born + ttl - now) / (ttl * FADE)));
+  const result = [
+    state.tiles,
+    new deck.ScatterplotLayer({
+      id: "points",
+      data: live,
+      filled: true,
+      opacity: 0.8,
+      radiusMinPixels: 10,
+      radiusMaxPixels: 120,
+      getLineColor: [255, 255, 255, 100],
+      getLineWidth: 2000,
+      getPosition: (p) => p.position,
+      getRadius: (p) => p.size * scale(p),
+      getFillColor: (p) => [p.color[0], p.color[1], p.color[2], p.color[3] * alpha(p)],
+      updateTriggers: { getRadius: now, getFillColor: now },
+    }),
+  ];
+  // 标记少时才显示地名，多了只会糊成一片
+  if (live.length <= state.labels) {
+    result.push(new deck.TextLayer({
+      id: "labels",
+      data: live,
+      getPosition: (p) => p.position,
+      getText: (p) => p.name,
+      getColor: (p) => [255, 255, 255, 255 * alpha(p)],
+      getSize: 20,
+      getAlignmentBaseline: "bottom",
+      getTextAnchor: "middle",
+      characterSet: "auto",
+      updateTriggers: { getColor: now },
+    }));
+  }
+  return result;
+}
+
+function tick(deck, state) {
+  const now = performance.now();
+  state.points = state.points.filter((p) => now - p.born < state.ttl);
+  state.deck.setProps({ layers: layers(deck, state, now) });
+  // 没有标记时停下动画循环，新批次到达时再启动
+  state.timer = state.points.length ? setTimeout(() => requestAnimationFrame(() => tick(deck, state)), 1000 / FPS) : null;
+}
+
+export default async function (component) {
+  const { parentElement } = component;
+  if (!component.data) return;
+  const data = JSON.parse(new TextDecoder().decode(component.data));
+  const state = parentElement.__liveMap || (parentElement.__liveMap = createState(parentElement));
+  const deck = await loadDeck();
+
+  if (!state.deck) {
+    state.tiles = basemap(deck);
+    state.deck = new deck.Deck({
+      parent: state.host, initialViewState: data.view, controller: CONTROLLER, layers: [state.tiles],
+      onViewStateChange: (change) => onViewStateChange(state, change),
+    });
+  } else if (!sameView(data.view, state.view) && !sameView(data.view, state.reported)) {
+    // 服务端换了视野 (地图视野/缩放控件)；服务端回传的是刚上报的视角时地图已经在那里，不要拉回去
+    state.deck.setProps({ initialViewState: { ...data.view, transitionDuration: 500 } });
+    state.reported = null;
+  }
+  state.view = data.view;
+  state.ttl = data.ttl * 1000;
+  state.delay = (data.delay || 0) * 1000;
+  state.labels = data.labels;
+  state.setStateValue = component.setStateValue;
+  if (data.idle_after && !state.watch) state.watch = watchActivity(state, data.idle_after * 1000);
+
+  if (data.now > state.lastNow) {
+    state.lastNow = data.now;
+    const now = performance.now();
+    for (const [lon, lat, r, g, b, a, size, age, name] of data.points) {
+      state.points.push({ position: [lon, lat], color: [r, g, b, a], size, name, born: now - age * 1000 + state.delay });
+    }
+    if (!state.timer && state.points.length) tick(deck, state);
+  }
+
+  return () => {
+    clearTimeout(state.timer);
+    clearTimeout(state.settle);
+    state.watch?.();
+    state.deck?.finalize();
+    delete parentElement.__liveMap;
+  };
+}
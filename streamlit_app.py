@@ -1,11 +1,27 @@
 import streamlit as st
-import pydeck as pdk
-import pandas as pd
+import numpy as np
 import sqlite3
 import datetime
 import os
 import time
-import random
+import threading
+import functools
+import json
+import queue
+import atexit
+import bisect
+import uuid
+import io
+from collections import deque
+from contextlib import closing
+
+# 模拟核心 (不依赖 Streamlit，可单独运行压测)，见 lifesim.py
+from lifesim import (
+    PROVINCES, PROV_INDEX, PROV_NAMES, POINT_TTL, MAP_MODE, AGGREGATE_THRESHOLD, BOARD_COLUMNS,
+    FLUSH_INTERVAL, SESSION_TIMEOUT, EVENT_HISTORY, EVENT_DEATH,
+    PLACE_FILE, Geography, PointRing, ProvinceBoard, Session, LifeEngine, EventLog, LeaderLock, SharedCounters,
+    SnapshotStore, pack_snapshot, unpack_snapshot, EventHub, StreamServer, missed_counts,
+)
 
 # ==========================================
 # 1. 全局配置 & CSS (WCAG 高对比度优化版)
@@ -17,215 +33,13 @@ st.set_page_config(
     initial_sidebar_state="collapsed"
 )
 
-st.markdown("""
-<style>
-    /* === 全局暗黑沉浸式背景 === */
-    .stApp {
-        background-color: #0e1117 !important;
-        color: #ffffff !important; /* 纯白主文字，对比度 15:1+ */
-    }
-    MainMenu, footer, header {visibility: hidden;}
-    .block-container { padding-top: 1rem; padding-bottom: 2rem; }
-
-    /* === 顶部 HUD 仪表盘 === */
-    .hud-container {
-        display: flex; justify-content: space-between; align-items: center;
-        background: rgba(20, 20, 20, 0.8);
-        backdrop-filter: blur(10px);
-        border-bottom: 1px solid rgba(255,255,255,0.15);
-        padding: 15px 30px; margin: -1rem -1rem 20px -1rem;
-        position: sticky; top: 0; z-index: 999;
-    }
-    .hud-title { 
-        font-size: 1.5rem; 
-        font-weight: 800; 
-        color: #ffffff !important; /* 纯白，最高对比度 */
-        letter-spacing: 1px; 
-    }
-    .hud-sub { 
-        font-size: 0.8rem; 
-        color: #f1f5f9 !important; /* 极浅灰，对比度 12:1+ */
-        text-transform: uppercase; 
-        letter-spacing: 2px; 
-        font-weight: 500; 
-    }
-    
-    /* === 统计数字样式 (超高对比度) === */
-    .stat-box { text-align: center; padding: 0 10px; }
-    .stat-val { 
-        font-size: 1.8rem; 
-        font-weight: 700; 
-        color: #4ade80 !important; /* 亮绿，对比度 8:1+ */
-        font-family: 'Courier New', monospace; 
-    }
-    .stat-death-val { 
-        font-size: 1.8rem; 
-        font-weight: 700; 
-        color: #f87171 !important; /* 亮红，对比度 7:1+ */
-        font-family: 'Courier New', monospace; 
-    }
-    .stat-label { 
-        font-size: 0.8rem; 
-        color: #f1f5f9 !important; /* 极浅灰 */
-        text-transform: uppercase; 
-        margin-top: -5px; 
-        font-weight: 600; 
-        letter-spacing: 1px; 
-    }
-
-    /* === 实时日志样式 (增强可读性) === */
-    .log-container {
-        height: 120px; overflow-y: hidden;
-        mask-image: linear-gradient(to bottom, black 80%, transparent 100%);
-        -webkit-mask-image: linear-gradient(to bottom, black 80%, transparent 100%);
-        border-left: 2px solid #64748b; /* 中灰边框，增加区分度 */
-        padding-left: 10px;
-    }
-    .log-item {
-        font-family: 'JetBrains Mono', 'Courier New', monospace;
-        font-size: 0.85rem; 
-        margin-bottom: 4px;
-        color: #ffffff !important; /* 纯白日志文字 */
-        text-shadow: 0 0 3px rgba(0,0,0,0.9); /* 增强文字边缘 */
-    }
-    .death-log-item {
-        font-family: 'JetBrains Mono', 'Courier New', monospace;
-        font-size: 0.85rem; 
-        margin-bottom: 4px;
-        color: #fca5a5 !important; /* 浅红，对比度 7:1+ */
-        text-shadow: 0 0 3px rgba(0,0,0,0.9);
-    }
-
-    /* === 咖啡/支付卡片样式 (高对比度) === */
-    .pay-amount-display { 
-        font-size: 2rem; 
-        font-weight: 800; 
-        color: #f87171 !important; /* 亮红 */
-        margin: 10px 0; 
-    }
-    .pay-label { 
-        font-size: 0.9rem; 
-        color: #f1f5f9 !important; /* 极浅灰 */
-        font-weight: 600; 
-        text-transform: uppercase; 
-        letter-spacing: 0.5px; 
-    }
-    .color-wechat { color: #4ade80 !important; } /* 亮绿 */
-    .color-alipay { color: #60a5fa !important; } /* 亮蓝 */
-    .color-paypal { color: #38bdf8 !important; } /* 亮青 */
-    
-    /* === 右上角按钮 (增强可见性) === */
-    .nav-btn {
-        background: rgba(255,255,255,0.15); 
-        border: 1px solid rgba(255,255,255,0.2);
-        color: #ffffff !important; /* 纯白按钮文字 */
-        padding: 5px 12px; 
-        border-radius: 20px; 
-        cursor: pointer;
-        font-size: 0.8rem; 
-        text-decoration: none; 
-        display: inline-block;
-    }
-    .nav-btn:hover { 
-        background: rgba(255,255,255,0.3); 
-        color: white !important; 
-    }
-    
-    /* === 表格与容器样式 (全高对比度) === */
-    [data-testid="stDataFrame"] { 
-        background: transparent !important; 
-        --background-color: transparent !important;
-        color: #ffffff !important; /* 表格文字纯白 */
-    }
-    [data-testid="stExpander"] {
-        background-color: rgba(255, 255, 255, 0.05) !important;
-        border: 1px solid rgba(255,255,255,0.1);
-        border-radius: 8px;
-        color: #ffffff !important; /* 展开栏文字纯白 */
-        margin-bottom: 1rem;
-    }
-    .streamlit-expanderHeader {
-        color: #ffffff !important; /* 展开栏标题纯白 */
-        font-weight: 600;
-        font-size: 1rem;
-    }
-    .streamlit-expanderContent {
-        padding: 0.5rem 1rem;
-    }
-    
-    /* === 地图容器优化 === */
-    [data-testid="stDeckGlJsonChart"] {
-        transition: opacity 0.2s ease-in-out !important;
-        opacity: 1 !important;
-    }
-    
-    /* === 按钮文字强制纯白 === */
-    button {
-        color: #ffffff !important;
-    }
-    
-    /* === 输入框文字优化 === */
-    [data-testid="stNumberInput"] input {
-        color: #ffffff !important; /* 输入框文字纯白 */
-        background-color: rgba(255,255,255,0.1) !important;
-    }
-    
-    /* === Tabs 文字优化 === */
-    [data-testid="stTabs"] [data-testid="stTab"] {
-        color: #ffffff !important; /* Tabs文字纯白 */
-    }
-    
-    /* === 链接按钮文字 === */
-    a {
-        color: #60a5fa !important; /* 链接亮蓝色，对比度 7:1+ */
-    }
-    
-    /* === 成功提示文字 === */
-    [data-testid="stSuccess"] {
-        color: #ffffff !important; /* 提示框文字纯白 */
-        background-color: rgba(74, 222, 128, 0.2) !important;
-        border: 1px solid #4ade80 !important;
-    }
-</style>
-""", unsafe_allow_html=True)
+# 样式表放在 static/style.css，走静态文件服务：浏览器缓存后，新会话和每次重跑都只发这一行
+st.markdown('<style>@import url("app/static/style.css");</style>', unsafe_allow_html=True)
 
 # ==========================================
 # 2. 核心数据
 # ==========================================
-PROVINCES = [
-    {"zh": "广东", "en": "Guangdong", "lat": 23.1, "lon": 113.2, "weight": 126},
-    {"zh": "山东", "en": "Shandong", "lat": 36.6, "lon": 117.0, "weight": 101},
-    {"zh": "河南", "en": "Henan", "lat": 34.7, "lon": 113.6, "weight": 98},
-    {"zh": "四川", "en": "Sichuan", "lat": 30.6, "lon": 104.0, "weight": 83},
-    {"zh": "江苏", "en": "Jiangsu", "lat": 32.0, "lon": 118.7, "weight": 85},
-    {"zh": "河北", "en": "Hebei", "lat": 38.0, "lon": 114.5, "weight": 74},
-    {"zh": "湖南", "en": "Hunan", "lat": 28.2, "lon": 112.9, "weight": 66},
-    {"zh": "浙江", "en": "Zhejiang", "lat": 30.2, "lon": 120.1, "weight": 65},
-    {"zh": "安徽", "en": "Anhui", "lat": 31.8, "lon": 117.2, "weight": 61},
-    {"zh": "湖北", "en": "Hubei", "lat": 30.5, "lon": 114.3, "weight": 58},
-    {"zh": "广西", "en": "Guangxi", "lat": 22.8, "lon": 108.3, "weight": 50},
-    {"zh": "云南", "en": "Yunnan", "lat": 25.0, "lon": 102.7, "weight": 47},
-    {"zh": "江西", "en": "Jiangxi", "lat": 28.6, "lon": 115.9, "weight": 45},
-    {"zh": "辽宁", "en": "Liaoning", "lat": 41.8, "lon": 123.4, "weight": 42},
-    {"zh": "福建", "en": "Fujian", "lat": 26.0, "lon": 119.2, "weight": 41},
-    {"zh": "陕西", "en": "Shaanxi", "lat": 34.2, "lon": 108.9, "weight": 39},
-    {"zh": "黑龙江", "en": "Heilongjiang", "lat": 45.7, "lon": 126.6, "weight": 31},
-    {"zh": "山西", "en": "Shanxi", "lat": 37.8, "lon": 112.5, "weight": 34},
-    {"zh": "贵州", "en": "Guizhou", "lat": 26.6, "lon": 106.6, "weight": 38},
-    {"zh": "重庆", "en": "Chongqing", "lat": 29.5, "lon": 106.5, "weight": 32},
-    {"zh": "吉林", "en": "Jilin", "lat": 43.8, "lon": 125.3, "weight": 23},
-    {"zh": "甘肃", "en": "Gansu", "lat": 36.0, "lon": 103.8, "weight": 24},
-    {"zh": "内蒙古", "en": "Inner Mongolia", "lat": 40.8, "lon": 111.7, "weight": 24},
-    {"zh": "新疆", "en": "Xinjiang", "lat": 43.8, "lon": 87.6, "weight": 25},
-    {"zh": "上海", "en": "Shanghai", "lat": 31.2, "lon": 121.4, "weight": 24},
-    {"zh": "北京", "en": "Beijing", "lat": 39.9, "lon": 116.4, "weight": 21},
-    {"zh": "天津", "en": "Tianjin", "lat": 39.0, "lon": 117.2, "weight": 13},
-    {"zh": "海南", "en": "Hainan", "lat": 20.0, "lon": 110.3, "weight": 10},
-    {"zh": "宁夏", "en": "Ningxia", "lat": 38.4, "lon": 106.2, "weight": 7},
-    {"zh": "青海", "en": "Qinghai", "lat": 36.6, "lon": 101.7, "weight": 5},
-    {"zh": "西藏", "en": "Tibet", "lat": 29.6, "lon": 91.1, "weight": 3},
-]
-PROV_WEIGHTS = [p['weight'] for p in PROVINCES]
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
 
 TEXTS = {
     'zh': {
@@ -241,7 +55,14 @@ TEXTS = {
         'pay_success': '收到！感谢打赏。代码写得更有劲了！❤️',
         'pay_wechat': '微信支付', 'pay_alipay': '支付宝', 'pay_paypal': '贝宝',
         'more_app': '更多应用', 'coffee_amount': '请输入打赏杯数',
-        'stat_tab_title': '📊 各省数据监控看板'
+        'stat_tab_title': '📊 各省数据监控看板',
+        'board_session': '本场', 'board_today': '今日全网', 'board_week': '近7天', 'board_all': '全部历史',
+        'global_today': '今日全网',
+        'time_scale': '时间倍速',
+        'replay_title': '⏪ 历史回放', 'replay_from': '回放起点', 'replay_speed': '回放倍速',
+        'replay_start': '▶ 开始回放', 'replay_stop': '⏹ 回到实时',
+        'replay_status': '正在回放 {time} 起的记录 · {speed}×', 'replay_done': '回放已追上当前时间',
+        'map_region': '地图视野', 'map_china': '🗺 全国', 'map_zoom': '缩放'
     },
     'en': {
         'title': 'China Population Sim',
@@ -256,89 +77,675 @@ TEXTS = {
         'pay_success': 'Received! Thanks for the coffee! ❤️',
         'pay_wechat': 'WeChat', 'pay_alipay': 'Alipay', 'pay_paypal': 'PayPal',
         'more_app': 'More Apps', 'coffee_amount': 'Enter Coffee Count',
-        'stat_tab_title': '📊 Provincial Statistics'
+        'stat_tab_title': '📊 Provincial Statistics',
+        'board_session': 'This Session', 'board_today': 'Today (All)', 'board_week': 'Last 7 Days', 'board_all': 'All Time',
+        'global_today': 'Today, all viewers',
+        'time_scale': 'Time Scale',
+        'replay_title': '⏪ Replay', 'replay_from': 'Start from', 'replay_speed': 'Speed',
+        'replay_start': '▶ Start replay', 'replay_stop': '⏹ Back to live',
+        'replay_status': 'Replaying from {time} · {speed}×', 'replay_done': 'Replay has caught up with live',
+        'map_region': 'Map Region', 'map_china': '🗺 All China', 'map_zoom': 'Zoom'
     }
 }
 
+@st.cache_resource
+def get_geography():
+    """首次需要落点时才读取区县表并建索引，所有会话共用一份；落点随机数和引擎一样取 SIM_SEED。"""
+    return Geography(PLACE_FILE, SIM_SEED)
+
 # ==========================================
 # 3. 状态管理
 # ==========================================
-def init_session():
-    defaults = {
-        'start_time': datetime.datetime.now(),
-        'language': 'zh',
-        'coffee_num': 1,
-        'has_counted': False,
-        'total_born': 0,
-        'total_death': 0,
-        'born_log': [],
-        'death_log': [],
-        'birth_map_data': pd.DataFrame(columns=['lat', 'lon', 'color', 'size', 'name', 'born_time'], dtype=object),
-        'death_map_data': pd.DataFrame(columns=['lat', 'lon', 'color', 'size', 'name', 'death_time'], dtype=object),
-        'prov_stats': {p['zh']: {'born': 0, 'death': 0, 'en': p['en']} for p in PROVINCES},
-        'birth_view_state': pdk.ViewState(latitude=35.0, longitude=105.0, zoom=3.0, pitch=20),
-        'death_view_state': pdk.ViewState(latitude=35.0, longitude=105.0, zoom=3.0, pitch=20),
-        'donate_success': False,  # 打赏成功提示状态
-        'show_balloons': False    # 气球动画触发状态
+class MapView:
+    """地图视角，字段与 pydeck.ViewState 相同；会话里只存这几个数，用 pydeck 渲染时再转换。"""
+
+    def __init__(self, latitude=35.0, longitude=105.0, zoom=3.0, pitch=20):
+        self.latitude, self.longitude, self.zoom, self.pitch = latitude, longitude, zoom, pitch
+
+# 会话默认值都是工厂函数：只在键缺失时调用，已有会话的重跑不再构造任何对象
+SESSION_DEFAULTS = {
+    'start_time': datetime.datetime.now,
+    'language': lambda: 'zh',
+    'coffee_num': lambda: 1,
+    'has_counted': lambda: False,
+    'session': Session,               # 本场总数、日志、省级排行和地图标记
+    'event_cursor': lambda: None,
+    'event_counts': lambda: None,     # 引擎在游标处的各省累计 (born, death)，落后太多时按差值补齐；回放中为 None
+    'time_scale': lambda: 1,          # 时间加速倍数，取值见 TIME_SCALES
+    'replay': lambda: None,           # 回放中时为 ReplaySource
+    'activity': lambda: 'active',     # 浏览器上报的页面状态：active / idle 闲置 / hidden 隐藏
+    'suspended': lambda: None,        # 隐藏暂停时记下的引擎累计计数 (回放中为 ())，未暂停为 None
+    'session_id': lambda: uuid.uuid4().hex,
+    'birth_view_state': MapView,
+    'death_view_state': MapView,
+    'show_balloons': lambda: False    # 气球动画触发状态
+}
+
+# 会话快照：URL 里带着会话令牌，页面刷新、断线重连或服务重启后的新会话按令牌找回上一份状态
+SNAPSHOT_DIR = os.path.join(os.path.expanduser("~"), "baby_map_sessions")
+SNAPSHOT_PARAM = "s"          # 携带会话令牌的查询参数
+SNAPSHOT_INTERVAL = 5.0       # 会话快照的保存间隔（秒）
+SNAPSHOT_TTL = 24 * 3600.0    # 超过该秒数没更新的快照不再恢复，启动时清理
+
+@st.cache_resource
+def get_snapshot_store():
+    return SnapshotStore(SNAPSHOT_DIR, SNAPSHOT_TTL)
+
+def pack_session():
+    """本会话的累计数、日志、排行榜、地图点和视角打成一份二进制快照。"""
+    ss = st.session_state
+    meta = {
+        'start_time': ss.start_time.timestamp(),
+        'language': ss.language,
+        'time_scale': ss.time_scale,
+        'total_born': ss.session.total_born,
+        'total_death': ss.session.total_death,
+        'born_log': list(ss.session.born_log),
+        'death_log': list(ss.session.death_log),
+        'views': {k: vars(ss[f'{k}_view_state']) for k in ('birth', 'death')},
     }
-    for k, v in defaults.items():
-        if k not in st.session_state: 
-            st.session_state[k] = v
+    arrays = {'board_born': ss.session.board.born, 'board_death': ss.session.board.death}
+    for k in ('birth', 'death'):
+        arrays.update((f'{k}_{name}', col) for name, col in getattr(ss.session, f'{k}_points').columns().items())
+    return pack_snapshot(meta, arrays)
+
+def restore_session(token):
+    """新会话按 URL 里的令牌恢复快照，成功返回 True。快照只恢复一次：恢复后的会话换新令牌，
+    复制出来的标签页各自往下走，不会互相覆盖。"""
+    try:
+        if token is None or uuid.UUID(hex=token).hex != token:
+            return False
+    except ValueError:
+        return False
+    started = time.perf_counter()
+    store = get_snapshot_store()
+    blob = store.load(token)
+    if blob is None:
+        return False
+    try:
+        meta, arrays = unpack_snapshot(blob)
+        ss = st.session_state
+        ss.start_time = datetime.datetime.fromtimestamp(meta['start_time'])
+        ss.language = meta['language']
+        ss.time_scale = meta['time_scale']
+        session = Session()
+        session.total_born, session.total_death = meta['total_born'], meta['total_death']
+        session.born_log.extend(map(tuple, meta['born_log']))
+        session.death_log.extend(map(tuple, meta['death_log']))
+        session.board = ProvinceBoard.from_counts(arrays['board_born'], arrays['board_death'])
+        for k in ('birth', 'death'):
+            getattr(session, f'{k}_points').extend(**{name: arrays[f'{k}_{name}'] for name, _, _ in PointRing.COLUMNS})
+            ss[f'{k}_view_state'] = MapView(**meta['views'][k])
+        ss.session = session
+    except (ValueError, KeyError, TypeError):
+        return False
+    finally:
+        store.discard(token)
+    ss.restore_ms = (time.perf_counter() - started) * 1000
+    return True
+
+def save_session(engine, view):
+    """每 SNAPSHOT_INTERVAL 秒把本会话写成快照；加速引擎的模拟时钟也顺带存一份 (每进程每倍速同样的间隔)。
+    回放和页面隐藏时不写，留着的是之前实时的那份；还没有任何事件的会话也不写。"""
+    now = time.time()
+    if now - view.saved_at < SNAPSHOT_INTERVAL or st.session_state.replay is not None or st.session_state.activity == 'hidden':
+        return
+    view.saved_at = now
+    store = get_snapshot_store()
+    session = st.session_state.session
+    if session.total_born or session.total_death:  # 还没并入过事件的会话没什么可恢复的，不为每个新访客落盘
+        store.save(st.session_state.session_id, pack_session())
+    engine_token = f'engine-{engine.time_scale}'
+    if engine.writer is None and store.age(engine_token) >= SNAPSHOT_INTERVAL:
+        store.save(engine_token, pack_snapshot(engine.snapshot(), {}))
+
+def init_session():
+    fresh = 'session_id' not in st.session_state
+    if fresh:
+        restore_session(st.query_params.get(SNAPSHOT_PARAM))
+    for k, make in SESSION_DEFAULTS.items():
+        if k not in st.session_state:
+            st.session_state[k] = make()
+    if fresh:
+        st.query_params[SNAPSHOT_PARAM] = st.session_state.session_id
 
 init_session()
+
+def reset_live_state():
+    """切换实时/回放时清空本会话的累计数据和画面缓存，两边的数据不混在一起。"""
+    st.session_state.session = Session()
+    st.session_state.event_cursor = None
+    st.session_state.live = LiveView()
 TXT = TEXTS[st.session_state.language]
 def get_txt(key): return TEXTS[st.session_state.language].get(key, key)
 
+# ==========================================
+# 3.1 运行指标 (可选开启，导出 Prometheus 文本格式)
+# ==========================================
+METRICS_ENABLED = os.environ.get("BAOBEI_METRICS", "0") == "1"
+METRICS_FILE = os.path.expanduser("~/baby_map.prom")
+METRICS_EXPORT_INTERVAL = 15.0  # 导出文件的间隔（秒）
+METRICS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+class Metrics:
+    """进程级指标：计数器、仪表和耗时直方图，外加各会话心跳，用于定位哪个阶段拖垮了刷新预算。"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}  # key -> [各桶计数 (最后一格为 +Inf), 总和, 次数, 最大值]
+        self.sessions = {}    # 会话 id -> (最后心跳时间, 地图点数)
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, n=1, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + n
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.gauges[self._key(name, labels)] = value
+
+    def observe(self, name, value, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            h = self.histograms.get(key)
+            if h is None:
+                h = self.histograms[key] = [[0] * (len(METRICS_BUCKETS) + 1), 0.0, 0, 0.0]
+            h[0][bisect.bisect_left(METRICS_BUCKETS, value)] += 1
+            h[1] += value
+            h[2] += 1
+            h[3] = max(h[3], value)
+
+    def heartbeat(self, session_id, points):
+        with self.lock:
+            self.sessions[session_id] = (time.time(), points)
+
+    def _refresh_sessions(self):
+        cutoff = time.time() - SESSION_TIMEOUT
+        for sid in [sid for sid, (seen, _) in self.sessions.items() if seen < cutoff]:
+            del self.sessions[sid]
+        self.gauges[self._key('sessions_active', {})] = len(self.sessions)
+        self.gauges[self._key('map_points', {})] = sum(points for _, points in self.sessions.values())
+
+    def summary(self):
+        """供调试面板展示：每个耗时指标的次数、均值和最大值 (毫秒)。"""
+        with self.lock:
+            self._refresh_sessions()
+            rows = [
+                {"metric": name + "".join(f"[{v}]" for _, v in labels), "count": count,
+                 "mean_ms": round(total / count * 1000, 3), "max_ms": round(peak * 1000, 3)}
+                for (name, labels), (_, total, count, peak) in sorted(self.histograms.items())
+            ]
+            values = {
+                name + "".join(f"[{v}]" for _, v in labels): value
+                for (name, labels), value in sorted({**self.counters, **self.gauges}.items())
+            }
+        return rows, values
+
+    def render(self):
+        """Prometheus 文本格式。"""
+        def fmt(name, labels, extra=()):
+            pairs = [f'{k}="{v}"' for k, v in (*labels, *extra)]
+            return f"baobei_{name}{{{','.join(pairs)}}}" if pairs else f"baobei_{name}"
+
+        lines = []
+        with self.lock:
+            self._refresh_sessions()
+            for kind, series in (("counter", self.counters), ("gauge", self.gauges)):
+                for name in sorted({name for name, _ in series}):
+                    lines.append(f"# TYPE baobei_{name} {kind}")
+                    lines += [f"{fmt(n, labels)} {value}" for (n, labels), value in sorted(series.items()) if n == name]
+            for name in sorted({name for name, _ in self.histograms}):
+                lines.append(f"# TYPE baobei_{name} histogram")
+                for (n, labels), (buckets, total, count, _) in sorted(self.histograms.items()):
+                    if n != name:
+                        continue
+                    cumulative = 0
+                    for le, c in zip((*METRICS_BUCKETS, "+Inf"), buckets):
+                        cumulative += c
+                        lines.append(f"{fmt(name + '_bucket', labels, [('le', le)])} {cumulative}")
+                    lines.append(f"{fmt(name + '_sum', labels)} {total}")
+                    lines.append(f"{fmt(name + '_count', labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def export(self, path):
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(self.render())
+        os.replace(tmp, path)
+
+    def start_exporter(self, path, interval):
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.export(path)
+                except OSError:
+                    self.inc('metrics_export_errors_total')
+        threading.Thread(target=run, name="metrics-exporter", daemon=True).start()
+        atexit.register(self.export, path)
+        return self
+
+@st.cache_resource
+def get_metrics():
+    """METRICS_ENABLED 关闭时返回 None，各处埋点直接跳过。"""
+    if not METRICS_ENABLED:
+        return None
+    return Metrics().start_exporter(METRICS_FILE, METRICS_EXPORT_INTERVAL)
+
 # ==========================================
 # 4. 核心逻辑函数
 # ==========================================
 DB_FILE = os.path.expanduser("~/baby_map.db")
 
-def track_stats():
+HISTORY_TTL = 30         # 历史排行榜查询结果的缓存时间（秒）
+
+class StatsWriter:
+    """进程级 SQLite 写入器：一个 WAL 连接、建表只做一次，计数增量排队后由后台线程合并成批量 upsert。"""
+
+    def __init__(self, path, metrics=None):
+        self.metrics = metrics
+        self.queue = queue.Queue()
+        self.errors = 0
+        self.last_error = None
+        self.lock = threading.Lock()
+        self.conn = None
+        try:
+            self.conn = sqlite3.connect(path, check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute('''CREATE TABLE IF NOT EXISTS stats (date TEXT, type TEXT, val INTEGER, UNIQUE(date, type))''')
+            self.conn.execute('''CREATE TABLE IF NOT EXISTS prov_daily (date TEXT, prov TEXT, born INTEGER, death INTEGER, PRIMARY KEY(date, prov))''')
+            self.conn.execute('''CREATE INDEX IF NOT EXISTS idx_prov_daily_prov ON prov_daily (prov, date)''')
+            self.conn.commit()
+        except sqlite3.Error as e:
+            self._fail(e)
+        self._thread = threading.Thread(target=self._run, name="stats-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def _fail(self, error):
+        self.errors += 1
+        self.last_error = repr(error)
+        if self.metrics:
+            self.metrics.inc('db_errors_total')
+
+    def incr(self, date, kind, n=1):
+        """只入队，不碰数据库，请求路径上零阻塞。"""
+        self.queue.put(('stats', (date, kind), (n, 0)))
+
+    def add_province_counts(self, date, born, death):
+        """入队一天内各省的新生/离世增量 (按省份下标排列的数组)。"""
+        for i in np.flatnonzero(born + death):
+            self.queue.put(('prov', (date, PROVINCES[i]['zh']), (int(born[i]), int(death[i]))))
+
+    def _run(self):
+        while True:
+            time.sleep(FLUSH_INTERVAL)
+            self.flush()
+
+    def flush(self):
+        """把队列里的增量按 (date, type) 合并后一次性写入。"""
+        pending = {'stats': {}, 'prov': {}}
+        while True:
+            try:
+                table, key, (a, b) = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            acc = pending[table].setdefault(key, [0, 0])
+            acc[0] += a
+            acc[1] += b
+        if not any(pending.values()) or self.conn is None:
+            return
+        started = time.perf_counter()
+        with self.lock:
+            try:
+                with self.conn:
+                    self.conn.executemany(
+                        "INSERT INTO stats VALUES (?, ?, ?) ON CONFLICT(date, type) DO UPDATE SET val = val + excluded.val",
+                        [(date, kind, n) for (date, kind), (n, _) in pending['stats'].items()]
+                    )
+                    self.conn.executemany(
+                        "INSERT INTO prov_daily VALUES (?, ?, ?, ?) ON CONFLICT(date, prov) DO UPDATE "
+                        "SET born = born + excluded.born, death = death + excluded.death",
+                        [(date, name, b, d) for (date, name), (b, d) in pending['prov'].items()]
+                    )
+            except sqlite3.Error as e:
+                self._fail(e)
+                # 合并后的增量条数有限，放回队列等下次重试
+                for table, counts in pending.items():
+                    for key, (a, b) in counts.items():
+                        self.queue.put((table, key, (a, b)))
+        if self.metrics:
+            self.metrics.observe('db_flush_seconds', time.perf_counter() - started)
+
+@st.cache_resource
+def get_stats_writer():
+    return StatsWriter(DB_FILE, get_metrics())
+
+@st.cache_data(ttl=HISTORY_TTL, show_spinner=False)
+def load_province_history(days=None):
+    """各省累计 (born, death) 数组；days 为 None 时统计全部历史，否则只统计最近 days 天。
+    结果在所有会话间共享缓存，HISTORY_TTL 秒后失效重查。"""
+    born = np.zeros(len(PROVINCES), dtype=np.int64)
+    death = np.zeros(len(PROVINCES), dtype=np.int64)
+    since = (datetime.date.today() - datetime.timedelta(days=days - 1)).isoformat() if days else ''
     try:
-        conn = sqlite3.connect(DB_FILE, check_same_thread=False)
-        c = conn.cursor()
-        c.execute('''CREATE TABLE IF NOT EXISTS stats (date TEXT, type TEXT, val INTEGER, UNIQUE(date, type))''')
+        with closing(sqlite3.connect(DB_FILE)) as conn:
+            rows = conn.execute(
+                "SELECT prov, SUM(born), SUM(death) FROM prov_daily WHERE date >= ? GROUP BY prov", (since,)
+            ).fetchall()
+    except sqlite3.Error:
+        return born, death
+    for name, b, d in rows:
+        if name in PROV_INDEX:
+            born[PROV_INDEX[name]], death[PROV_INDEX[name]] = b, d
+    return born, death
+
+def track_stats():
+    if not st.session_state.has_counted:
+        started = time.perf_counter()
         today = datetime.datetime.utcnow().date().isoformat()
-        if not st.session_state.has_counted:
-            c.execute("INSERT OR IGNORE INTO stats VALUES (?, 'pv', 0)", (today,))
-            c.execute("UPDATE stats SET val = val + 1 WHERE date=? AND type='pv'", (today,))
-            conn.commit()
-            st.session_state.has_counted = True
-        conn.close()
-    except Exception as e:
-        pass
+        get_stats_writer().incr(today, 'pv')
+        st.session_state.has_counted = True
+        if get_metrics():
+            get_metrics().observe('track_stats_seconds', time.perf_counter() - started)
 
 track_stats()
 
-def generate_baby():
-    prov = random.choices(PROVINCES, weights=PROV_WEIGHTS, k=1)[0]
-    gender = random.choice(['m', 'f'])
-    color = [0, 255, 255, 200] if gender == 'm' else [255, 0, 255, 200]
-    st.session_state.prov_stats[prov['zh']]['born'] += 1
-    return {"zh": prov["zh"], "en": prov["en"], "gender": gender, "lat": prov['lat'], "lon": prov['lon'], "color": color}
+# ==========================================
+# 4.1 共享模拟引擎 (每个服务进程只跑一份)
+# ==========================================
+REFRESH_RATE = 0.8
+TIME_SCALES = (1, 60, 3600)  # 时间加速倍数：3600× 下一个模拟日只要 24 秒
+SIM_SEED = None      # 固定种子可复现同一事件流和地图落点
+class FrameTimer:
+    """分段计时：每次 lap 记下距上一次 lap 的耗时（秒）。"""
+
+    def __init__(self):
+        self.mark = time.perf_counter()
+        self.stages = {}
+
+    def lap(self, name):
+        now = time.perf_counter()
+        self.stages[name] = now - self.mark
+        self.mark = now
+
+FRAME_BUDGET = 0.25        # 渲染耗时占刷新周期的比例上限，超出就拉长帧间隔
+SESSIONS_PER_CPU = 20      # 每个 CPU 核心按满帧率服务的会话数
+MAX_FRAME_INTERVAL = 4.0   # 帧间隔最多拉长到多少秒
+MAP_MAX_INTERVAL = POINT_TTL / 2  # 有新标记时地图最长多久重建一次，保证每个标记在过期前至少显示半个寿命
+FRAME_SLACK = 0.25         # 片段定时器提前多少 (占基础周期的比例) 仍算到点，浏览器计时器的抖动不会让一帧白白跳过
+
+def load_per_cpu():
+    try:
+        return os.getloadavg()[0] / (os.cpu_count() or 1)
+    except (AttributeError, OSError):
+        return 0.0
+
+class FrameScheduler:
+    """自适应帧调度：模拟按自己的节奏推进，渲染间隔随渲染耗时、在线会话数和系统负载自动拉长。"""
+
+    def __init__(self, base):
+        self.base = base
+        self.interval = base
+        self.next_at = 0.0
+        self.maps_at = 0.0  # 上次重建地图的时刻
+
+    def due(self, now):
+        return now >= self.next_at
+
+    def maps_due(self, now):
+        """地图跟着帧间隔重建，但帧间隔拉长 (或闲置) 到超过 MAP_MAX_INTERVAL 时也照常重建，新标记不会没显示就过期。"""
+        return now >= self.next_at or now - self.maps_at >= MAP_MAX_INTERVAL
+
+    def rendered(self, started, cost, sessions, floor=0.0):
+        """一帧渲染完成后按当前压力决定下一帧最早何时开始；floor 为本会话要求的最短间隔。
+        片段的 run_every 从每次运行开始时计时，下一帧也从本帧开始的时刻 started 算起，不是从渲染结束算起。"""
+        pressure = max(
+            1.0,
+            cost / (self.base * FRAME_BUDGET),
+            sessions / (SESSIONS_PER_CPU * (os.cpu_count() or 1)),
+            load_per_cpu(),
+        )
+        self.interval = max(min(self.base * pressure, MAX_FRAME_INTERVAL), floor)
+        self.next_at = started + self.interval - self.base * FRAME_SLACK
+
+@st.cache_resource
+def get_engine(time_scale=1):
+    """每个加速倍数各一份引擎，有人选用时才启动；加速引擎各进程独立。
+    1× 的真实时间流在同一主机的所有进程间只生成一份：领导者写数据库、事件日志和共享计数，其余进程跟读。"""
+    if time_scale != 1:
+        engine = LifeEngine(REFRESH_RATE, SIM_SEED, time_scale, metrics=get_metrics())
+        # 服务重启后加速引擎的模拟时钟从上次保存处接着走
+        blob = get_snapshot_store().load(f'engine-{time_scale}')
+        if blob is not None:
+            try:
+                engine.restore(unpack_snapshot(blob)[0])
+            except (ValueError, KeyError):
+                pass
+        return engine.start()
+    engine = LifeEngine(
+        REFRESH_RATE, SIM_SEED, writer=get_stats_writer(), event_log=get_event_log(), metrics=get_metrics(),
+        leader=get_leader_lock(), counters=get_counters()
+    )
+    # 退出时把还没交给写入器的当日增量交出去；atexit 倒序执行，这一步排在写入器的 flush 之前
+    atexit.register(engine.persist)
+    return engine.start()
+
+# ==========================================
+# 4.2 事件日志 (追加写入的二进制文件，按小时分块，内存映射读取)
+# ==========================================
+EVENT_LOG_DIR = os.path.join(os.path.expanduser("~"), "baby_map_events")
+
+@st.cache_resource
+def get_event_log():
+    return EventLog(EVENT_LOG_DIR, get_metrics())
+
+REPLAY_SPEEDS = (10, 100, 1000)
+
+class ReplaySource:
+    """回放事件日志：对外和 LifeEngine 一样提供 seq / events_since / touch / active_sessions，
+    实时区域和表格沿用同一套渲染路径。每个会话一份，按回放倍速推进自己的模拟时钟。"""
+
+    def __init__(self, log, engine, start, speed):
+        self.log = log
+        self.engine = engine  # 在线会话统计仍记在实时引擎上
+        self.start = start
+        self.speed = speed
+        self.pos = start      # 已读到的模拟时间
+        self.started = time.time()
+        self.finished = False
+        self.seq = 0
+        self.batches = deque(maxlen=EVENT_HISTORY)
+        self.lock = threading.Lock()
+
+    def clock(self):
+        return self.start + (time.time() - self.started) * self.speed
+
+    def _advance(self):
+        """把回放时钟走过的这段日志打包成一个批次，格式与引擎批次相同。"""
+        end = min(self.clock(), time.time())
+        if end <= self.pos:
+            return
+        events = self.log.read(self.pos, end)
+        self.pos = end
+        self.finished = end >= time.time() - FLUSH_INTERVAL
+        if not len(events):
+            return
+        births = events[events['kind'] != EVENT_DEATH]
+        self.seq += 1
+        self.batches.append({
+            "seq": self.seq, "ts": time.time(), "sim_ts": float(events['ts'][-1]),
+            "birth_prov": births['prov'], "birth_gender": births['kind'],
+            "death_prov": events['prov'][events['kind'] == EVENT_DEATH],
+        })
+
+    def events_since(self, cursor):
+        with self.lock:
+            # 回放源只属于本会话，cursor 之前的批次两个片段都已经并入，不必再留着
+            while self.batches and self.batches[0]["seq"] <= cursor:
+                self.batches.popleft()
+            self._advance()
+            return [b for b in self.batches if b["seq"] > cursor], self.seq
+
+    def counts(self):
+        """暂停后恢复时回放源直接从日志补读那段时间，不需要累计计数。"""
+        return None
+
+    def touch(self, session_id):
+        self.engine.touch(session_id)
 
-def generate_death():
-    prov = random.choices(PROVINCES, weights=PROV_WEIGHTS, k=1)[0]
-    color = [248, 113, 113, 200] 
-    st.session_state.prov_stats[prov['zh']]['death'] += 1
-    return {"zh": prov["zh"], "en": prov["en"], "lat": prov['lat'], "lon": prov['lon'], "color": color}
+    def active_sessions(self):
+        return self.engine.active_sessions()
+
+# ==========================================
+# 4.3 同一主机多进程共享 (选举锁 + 共享计数)
+# ==========================================
+# 多个 Streamlit 进程跑在同一台机器上时，只有领导者进程生成 1× 事件、写数据库和事件日志，
+# 其余进程跟读事件日志；当日全国计数放在内存映射文件里，所有进程的所有会话读同一份
+LEADER_FILE = os.path.expanduser("~/baby_map.leader")
+COUNTER_FILE = os.path.expanduser("~/baby_map.counters")
+
+@st.cache_resource
+def get_leader_lock():
+    return LeaderLock(LEADER_FILE)
+
+@st.cache_resource
+def get_counters():
+    return SharedCounters(COUNTER_FILE, len(PROVINCES))
+
+# ==========================================
+# 4.4 事件流接口 (本地 HTTP，NDJSON / SSE，可选开启)
+# ==========================================
+# 设置 BAOBEI_STREAM_PORT 后随应用启动：GET /events 输出 1× 实时流的出生和离世，看板和测试不必抓取页面
+STREAM_PORT = int(os.environ.get("BAOBEI_STREAM_PORT", "0"))  # 0 不开启
+STREAM_HOST = os.environ.get("BAOBEI_STREAM_HOST", "127.0.0.1")
+
+@st.cache_resource
+def get_event_stream():
+    """同一主机多进程时端口只有一个进程绑得上，其余进程不提供 (跟随进程转发的是同一条事件流)。"""
+    try:
+        return StreamServer((STREAM_HOST, STREAM_PORT), EventHub(get_engine(), get_metrics())).start()
+    except OSError:
+        return None
+
+if STREAM_PORT:
+    get_event_stream()
 
 # ==========================================
 # 5. 地图渲染
 # ==========================================
+# 浏览器端地图用的 deck.gl 随仓库放在 static/vendor/ (版本固定，与 static/live_map.js 的 DECK_URL 一致)，运行时不依赖第三方 CDN；
+# 文件取自 pydeck 附带的独立包 (pydeck/nbextension/static/index.js)，加载后 window.deck 即完整的 deck.gl
+DECK_VERSION = "9.3.6"
+DECK_BUNDLE = os.path.join(APP_DIR, "static", "vendor", f"deck.gl-{DECK_VERSION}.js")
+# "client" 浏览器端动画，只下发新事件 / "pydeck" 服务端每次重建整张地图 (用 Streamlit 自带的 deck.gl)；
+# 默认 deck.gl 已放进 static/vendor/ 时用 client，否则退回 pydeck，可用 BAOBEI_MAP_RENDERER 指定
+MAP_RENDERER = os.environ.get("BAOBEI_MAP_RENDERER") or ("client" if os.path.exists(DECK_BUNDLE) else "pydeck")
+# 实时片段的重跑间隔（秒）。浏览器端地图按自己的时钟播放标记，服务端只需定期送来新批次和数字：
+# 标记在浏览器里统一顺延这么久出现，按原来的先后和完整寿命播放，重跑可以比模拟步长稀疏得多；
+# pydeck 每一帧都要在服务端重画，仍按 REFRESH_RATE
+LIVE_REFRESH_RATE = 2.5 if MAP_RENDERER == "client" else REFRESH_RATE
+MAP_STYLE = "https://basemaps.cartocdn.com/gl/dark-matter-gl-style/style.json"
+POINTS_SLOT = "__POINTS__"  # 模板中点数据的占位符
+MAP_HEIGHT = 500
+
 def create_map_layers(data, layer_type="birth"):
-    if data.empty: return []
+    import pydeck as pdk  # 只有 pydeck 渲染方式用得到，不拖慢冷启动
+
     common_layer_props = {"filled": True, "opacity": 0.8, "radius_min_pixels": 10, "radius_max_pixels": 120, "get_line_color": [255, 255, 255, 100], "get_line_width": 2000}
-    scatter_layer = pdk.Layer("ScatterplotLayer", data=data, get_position='[lon, lat]', get_fill_color='color', get_radius='size', **common_layer_props)
-    text_layer = pdk.Layer("TextLayer", data=data, get_position='[lon, lat]', get_text='name', get_color=[255, 255, 255], get_size=20, get_alignment_baseline="'bottom'", get_text_anchor="'middle'")
+    scatter_layer = pdk.Layer("ScatterplotLayer", id=f"{layer_type}-points", data=data, get_position='[lon, lat]', get_fill_color='color', get_radius='size', **common_layer_props)
+    text_layer = pdk.Layer("TextLayer", id=f"{layer_type}-labels", data=data, get_position='[lon, lat]', get_text='name', get_color=[255, 255, 255], get_size=20, get_alignment_baseline="'bottom'", get_text_anchor="'middle'")
     return [scatter_layer, text_layer]
 
-def render_map(placeholder, data, view_state, title, layer_type):
-    layers = create_map_layers(data, layer_type)
-    deck = pdk.Deck(map_style="https://basemaps.cartocdn.com/gl/dark-matter-gl-style/style.json", initial_view_state=view_state, layers=layers, tooltip=False, map_provider=None, api_keys={})
-    placeholder.markdown(f"<h4 style='text-align:center; color:#4ade80'>{title}</h4>", unsafe_allow_html=True)
-    placeholder.pydeck_chart(deck, use_container_width=True)
+class DeckSpec:
+    """已序列化好的 Deck，按 st.pydeck_chart 需要的接口提供 to_json。"""
+    layers = []
+
+    def __init__(self, spec):
+        self.spec = spec
+
+    def to_json(self):
+        return self.spec
+
+@functools.lru_cache(maxsize=16)
+def deck_template(layer_type, view_key):
+    """静态部分 (底图、视角、图层属性) 只构建并序列化一次，按占位符切开。"""
+    import pydeck as pdk
+
+    layers = create_map_layers(POINTS_SLOT, layer_type)
+    # 视角只由地图视野/缩放控件决定 (标记按它裁剪)，关掉鼠标拖动和缩放
+    view = pdk.View("MapView", controller=False)
+    deck = pdk.Deck(map_style=MAP_STYLE, views=[view], initial_view_state=pdk.ViewState(**dict(view_key)), layers=layers, tooltip=False, map_provider=None, api_keys={})
+    compact = json.dumps(json.loads(deck.to_json()), separators=(',', ':'), ensure_ascii=False)
+    return tuple(compact.split(json.dumps(POINTS_SLOT)))
+
+def view_key(view_state):
+    return tuple((k, v) for k, v in vars(view_state).items() if v is not None)
+
+def map_spec(data, view_state, layer_type):
+    """完整的 Deck JSON：静态部分取自缓存模板，只有点数据需要现场编码。"""
+    payload = json.dumps(data, separators=(',', ':'), ensure_ascii=False)
+    return payload.join(deck_template(layer_type, view_key(view_state)))
+
+# 组件本体只是个加载器：真正的脚本走静态文件服务，浏览器缓存后每次下发不必再带上它
+LIVE_MAP_LOADER = """
+export default async function (component) {
+  const { default: render } = await import(new URL("app/static/live_map.js", document.baseURI));
+  return render(component);
+}
+"""
+
+def get_live_map():
+    """浏览器端地图组件 (deck.gl)。注册表随运行时重建，所以每次运行都登记一遍；定义相同时只是覆盖。"""
+    return st.components.v2.component("baobei_live_map", js=LIVE_MAP_LOADER)
+
+# pydeck 渲染时页面上没有浏览器端地图，改由这个不显示内容的探针上报页面状态 (脚本见 static/activity.js)
+ACTIVITY_LOADER = LIVE_MAP_LOADER.replace("live_map.js", "activity.js")
+
+def get_activity_probe():
+    return st.components.v2.component("baobei_activity", js=ACTIVITY_LOADER)
+
+def follow_view(view, layer_type, reported):
+    """浏览器端地图拖动/缩放后上报的视角：存进会话，下一次重建地图起按它裁剪标记、选细节层级。"""
+    key = f'{layer_type}_view_state'
+    if not reported or reported == vars(st.session_state[key]):
+        return
+    st.session_state[key] = MapView(*(float(reported[k]) for k in ('latitude', 'longitude', 'zoom', 'pitch')))
+    view.maps_dirty = True
+
+def live_map_data(points, since, names, view_state, mode=MAP_MODE, idle_after=None):
+    """浏览器端地图一次下发的数据：since 之后新进入缓冲、且在视野内的标记。
+    每个标记附带已存在的秒数，浏览器顺延 delay 秒后播放，长大、淡出和过期按自己的时钟计算；
+    一批新标记太多时 (时间加速) 先按地区聚合，每个地区只长出一个气泡。
+    给了 idle_after 时该地图负责上报页面状态 (隐藏 / 闲置超过 idle_after 秒)。"""
+    now = time.time()
+    idx, keys, labels = points.select(
+        points.newer(since), names, get_geography(), (view_state.latitude, view_state.longitude, view_state.zoom)
+    )
+    if mode == "province" or (mode == "auto" and len(idx) > AGGREGATE_THRESHOLD):
+        records = points.aggregate(idx, keys, labels)
+        ages = [round(now - float(points.ts[idx].max()), 3)] * len(records)
+    else:
+        records = points.records(idx, keys, labels)
+        ages = np.round(now - points.ts[idx], 3).tolist()
+    data = {
+        "now": now,
+        "ttl": POINT_TTL,
+        "delay": LIVE_REFRESH_RATE,
+        "labels": AGGREGATE_THRESHOLD,
+        "view": dict(vars(view_state)),
+        "points": [[r["lon"], r["lat"], *r["color"], r["size"], age, r["name"]] for r, age in zip(records, ages)],
+    }
+    if idle_after is not None:
+        data["idle_after"] = idle_after
+    return data
 
 # ==========================================
 # 6. UI: 顶部 HUD
@@ -357,51 +764,496 @@ with c_hud_1:
 
 with c_hud_2:
     cols = st.columns([1, 1, 1])
+    with cols[0]:
+        def switch_time_scale():
+            # 换到另一份引擎：游标从新引擎的当前位置开始，缓存的画面重建
+            st.session_state.replay = None
+            st.session_state.event_cursor = None
+            st.session_state.live = LiveView()
+        st.selectbox(
+            get_txt('time_scale'), TIME_SCALES, key='time_scale',
+            format_func=lambda s: f"⏱ {s}×", on_change=switch_time_scale, label_visibility="collapsed"
+        )
     with cols[1]:
         lang_btn = "🌐 EN" if st.session_state.language == 'zh' else "🌐 中"
-        if st.button(lang_btn, use_container_width=True):
+        def toggle_language():
             st.session_state.language = 'en' if st.session_state.language == 'zh' else 'zh'
-            st.rerun()
+            # 语言变了，缓存的统计区和地图标签都要重建
+            st.session_state.live = LiveView()
+        # 回调在脚本重跑之前执行，一次重跑就能切换语言
+        st.button(lang_btn, width="stretch", on_click=toggle_language)
     with cols[2]:
         st.markdown(f'<a href="https://laodeng.streamlit.app" target="_blank" class="nav-btn" style="text-align:center; width:100%; padding: 8px 0;">{TXT["more_app"]} ↗</a>', unsafe_allow_html=True)
 
+# 地图视野：全国或某个省，放大后按地级市 / 区县显示，视野外的标记不发给前端
+CHINA_VIEW = (35.0, 105.0)
+MAP_ZOOMS = (3.0, 4.0, 5.0, 6.0, 7.0)
+
+def focus_map():
+    region, zoom = st.session_state.map_region, st.session_state.map_zoom
+    lat, lon = CHINA_VIEW if region < 0 else (PROVINCES[region]['lat'], PROVINCES[region]['lon'])
+    for key in ('birth_view_state', 'death_view_state'):
+        st.session_state[key] = MapView(lat, lon, zoom)
+    st.session_state.live.maps_dirty = True
+
+c_region, c_zoom, _ = st.columns([1, 1, 2])
+with c_region:
+    region_names = [TXT['map_china']] + PROV_NAMES[st.session_state.language]
+    st.selectbox(
+        TXT['map_region'], [-1] + list(range(len(PROVINCES))), key='map_region', on_change=focus_map,
+        format_func=lambda i: region_names[i + 1],
+        label_visibility="collapsed"
+    )
+with c_zoom:
+    st.select_slider(
+        TXT['map_zoom'], MAP_ZOOMS, value=3.0, key='map_zoom', on_change=focus_map,
+        format_func=lambda z: f"🔍 {z:g}", label_visibility="collapsed"
+    )
+
 # ==========================================
-# 7. 双地图布局
+# 7. 实时区域：双地图 + 统计 (片段定时重跑，不再占住脚本线程)
 # ==========================================
-st.write("")
-col_birth, col_death = st.columns(2, gap="medium")
-birth_map_placeholder = col_birth.empty()
-death_map_placeholder = col_death.empty()
+TABLE_REFRESH_RATE = 2.0  # 省份表格随新事件重建的最短间隔（秒）；切换范围或语言时立即重建
+# 页面状态由浏览器端地图组件上报，pydeck 渲染时由页面状态探针上报：
+# 隐藏的标签页暂停，恢复时按累计计数一次补齐；可见但久无操作的降为低频心跳，只刷新数字
+IDLE_AFTER = 600.0            # 页面可见但超过该秒数没有键鼠/触摸操作就算闲置
+ACTIVITY_DATA = json.dumps({"idle_after": IDLE_AFTER}).encode()  # 探针的 data，内容不变，浏览器端只在首次挂载时读取
+IDLE_FRAME_INTERVAL = 10.0    # 闲置会话刷新数字的最短间隔（秒）；地图只在有新标记时按 MAP_MAX_INTERVAL 补发
+
+def compile_templates(texts):
+    """把某种语言的文案和外层 HTML 预先拼成模板，渲染时只剩一次 str.format。"""
+    # 第一个空位是本会话的数，第二个是所有进程共享的今日全网合计
+    stat_box = (
+        '<div class="stat-box"><div class="{cls}">{{}}</div><div class="stat-label">{label}</div>'
+        '<div class="stat-global">{today} {{:,}}</div></div>'
+    )
+    return {
+        'born_count': stat_box.format(cls='stat-val', label=texts['born_count'], today=texts['global_today']).format,
+        'death_count': stat_box.format(cls='stat-death-val', label=texts['death_count'], today=texts['global_today']).format,
+        'log_box': '<div class="log-container">{}</div>'.format,
+        # 下标为性别：0 男孩 (青色) / 1 女孩 (品红)
+        'born_log': (
+            f'<div class="log-item" style="color:#22d3ee">{texts["log_boy"]}</div>'.format,
+            f'<div class="log-item" style="color:#e879f9">{texts["log_girl"]}</div>'.format,
+        ),
+        'death_log': f'<div class="death-log-item">{texts["log_death"]}</div>'.format,
+    }
+
+STAT_TEMPLATES = {lang: compile_templates(texts) for lang, texts in TEXTS.items()}
+
+class LiveView:
+    """单个会话实时区域的跨帧状态：帧调度器、脏标记和上一次的渲染结果。
+    片段每次重跑都要重新输出自己的元素，没有变化或没到渲染时间时直接复用这里缓存的结果。"""
+
+    def __init__(self):
+        self.scheduler = FrameScheduler(LIVE_REFRESH_RATE)
+        self.stats_dirty = True
+        self.maps_dirty = True
+        self.stats_html = None
+        self.html = {}          # 占位符 -> (内容, HTML)
+        self.map_specs = {}     # 地图类型 -> pydeck JSON 或浏览器端地图的数据
+        self.map_sent = dict.fromkeys(('birth', 'death'), time.time())  # 浏览器端地图已下发到的标记时间戳
+        self.table = None       # (board_key, 表格, 列配置)
+        self.table_at = 0.0     # 上次重建表格的时间
+        self.last_frame = None  # 上一帧开始的时间，下一帧的调度和帧间隔超时统计都从它算起
+        self.frames = 0
+        self.timer = None       # 上一帧的分段耗时，供调试面板显示
+        self.saved_at = 0.0     # 上次保存会话快照的时间
+
+    def render(self, name, content, build):
+        """按内容缓存单个占位符的 HTML：内容与上次相等就返回上次的字符串，不等才调用 build 重新拼接。
+        存内容本身而不是哈希，哈希碰撞不会留下过期的画面；元组比较一般在第一个不同的元素就结束。"""
+        cached = self.html.get(name)
+        if cached is None or cached[0] != content:
+            cached = self.html[name] = (content, build())
+        return cached[1]
+
+if 'live' not in st.session_state:
+    st.session_state.live = LiveView()
+    if 'restore_ms' in st.session_state:
+        # 从快照恢复的会话：浏览器端地图是新的，把还没过期的标记补发过去
+        st.session_state.live.map_sent = dict.fromkeys(('birth', 'death'), time.time() - POINT_TTL)
+
+def suspend_session(engine, view):
+    """页面隐藏：先把游标之后已到的事件并入计数，再记下引擎的累计计数，交还地图点缓冲、清空渲染缓存；之后的重跑只重发上次的画面。"""
+    if st.session_state.suspended is not None:
+        return
+    counts = engine.counts()
+    session = st.session_state.session
+    if st.session_state.event_cursor is not None:
+        # 隐藏前还没并入的批次要算进总数，否则恢复时按差值补齐会漏掉它们
+        merge_events(engine, session, upto=counts[0] if counts else None, points=False)
+    st.session_state.suspended = counts or ()
+    for ring in session.rings:
+        ring.release()  # 缓冲按容量整块分配，隐藏期间不占着；重新可见后第一批标记到达时再分配
+    view.html.clear()
+
+def resume_session(engine, view):
+    """页面重新可见：跳过暂停期间的逐条事件，按累计计数的差值一次补齐总数和排行榜。"""
+    paused, st.session_state.suspended = st.session_state.suspended, None
+    current = engine.counts()
+    if paused and current:
+        seq, born, death = current
+        st.session_state.session.add_counts(born - paused[1], death - paused[2])
+        st.session_state.event_cursor, st.session_state.event_counts = seq, (born, death)
+    view.stats_dirty = view.maps_dirty = True
+
+def merge_events(engine, session, upto=None, points=True):
+    """把游标之后 (至多到 upto) 的批次并入会话，推进游标并记下引擎在游标处的累计计数，返回并入的批次。
+    游标落后超过 EVENT_HISTORY 批 (计时器被节流、短暂断线) 时，被挤出历史的那些按累计计数的差值一次补齐。"""
+    cursor = st.session_state.event_cursor
+    batches, seq = engine.events_since(cursor)
+    if upto is not None:
+        batches, seq = [b for b in batches if b['seq'] <= upto], upto
+    missed = missed_counts(batches, cursor, st.session_state.event_counts)
+    if missed is not None:
+        session.add_counts(*missed)
+        metrics = get_metrics()
+        if metrics:
+            metrics.inc('event_gaps_total')
+    geo = get_geography()
+    for batch in batches:
+        session.apply(batch, geo, points=points)
+    st.session_state.event_cursor = seq
+    if batches and 'born_total' in batches[-1]:
+        st.session_state.event_counts = (batches[-1]['born_total'], batches[-1]['death_total'])
+    return batches
+
+def session_footprint(view, rings):
+    """本会话可回收状态实际占用的字节数：地图点缓冲的分配加上渲染缓存。"""
+    size = sum(ring.nbytes for ring in rings) + sum(len(spec) for spec in view.map_specs.values())
+    return size + sum(len(html) for _, html in view.html.values())
+
+def sync_session(engine, view, timer=None):
+    """把引擎里新到的事件并入本会话状态，并按时间戳过期地图标记。多个片段共用，重复调用没有副作用。
+    页面隐藏时什么都不并入 (也不登记在线)，重新可见时先补齐暂停期间的计数。"""
+    if st.session_state.activity == 'hidden':
+        suspend_session(engine, view)
+        return
+    if st.session_state.suspended is not None:
+        resume_session(engine, view)
+    if st.session_state.event_cursor is None:
+        counts = engine.counts()
+        st.session_state.event_cursor = counts[0] if counts else engine.seq
+        st.session_state.event_counts = counts[1:] if counts else None
+    ts = time.time()
+    session = st.session_state.session
+    batches = merge_events(engine, session)
+    if timer:
+        timer.lap('events')
+
+    # 清理过期数据 (按时间戳过期，环形缓冲无需复制)
+    expired = session.expire(ts - POINT_TTL)
+    if timer:
+        timer.lap('cleanup')
+
+    engine.touch(st.session_state.session_id)
+    view.stats_dirty = view.stats_dirty or bool(batches)
+    # 浏览器端地图自己过期标记，服务端过期不需要重发
+    view.maps_dirty = view.maps_dirty or bool(batches) or (expired > 0 and MAP_RENDERER == "pydeck")
+
+# 统计区一行四格 (本场新生 | 新生日志 | 离世日志 | 本场离世) 加下方分隔线，整行只输出一个元素：
+# 比四列各放一个占位符少发九条消息，片段每次重跑的开销主要就在消息条数上
+STATS_ROW = '<div class="stats-row">{}{}{}{}</div><hr>'.format
+
+def build_stats_html(view):
+    """统计区四格的 HTML，各自按内容缓存：数字或日志没变的格子直接沿用上次的字符串。"""
+    lang = st.session_state.language
+    tpl, names = STAT_TEMPLATES[lang], PROV_NAMES[lang]
+    session = st.session_state.session
+    born_log, death_log = tuple(session.born_log), tuple(session.death_log)
+    born_all, death_all, _, _ = get_counters().snapshot()
+    return [
+        view.render('born_count', (lang, session.total_born, born_all),
+                    lambda: tpl['born_count'](session.total_born, born_all)),
+        view.render('born_log', (lang, born_log), lambda: tpl['log_box']("".join(
+            tpl['born_log'][g](time=t, prov=names[p]) for t, p, g in born_log
+        ))),
+        view.render('death_log', (lang, death_log), lambda: tpl['log_box']("".join(
+            tpl['death_log'](time=t, prov=names[p]) for t, p in death_log
+        ))),
+        view.render('death_count', (lang, session.total_death, death_all),
+                    lambda: tpl['death_count'](session.total_death, death_all)),
+    ]
+
+def make_live_slots(replace=False):
+    """实时区域各元素的位置。片段每次重跑只输出一帧，直接写进各列和片段本身，不必先占一个 st.empty 再替换 (每个元素少发一条消息)；
+    replace 为真时各放一个 st.empty，同一次运行里可以反复重画 (基准测试逐帧输出)。"""
+    col_birth, col_death = st.columns(2, gap="medium")
+    if replace:
+        return {'birth': col_birth.empty(), 'death': col_death.empty(), 'stats': st.empty()}
+    # 统计行紧跟在地图下面，用 st 本身输出到片段的当前位置
+    return {'birth': col_birth, 'death': col_death, 'stats': st}
+
+def live_frame(slots, engine, metrics, view, bench=False):
+    """实时区域的一帧：并入事件、按调度决定是否重建统计区和地图，再输出 (重建或复用缓存)。"""
+    timer = FrameTimer()
+    now = time.perf_counter()
+    if metrics and not bench and view.last_frame is not None:
+        # 两帧间隔超出刷新周期的部分
+        metrics.observe('frame_overshoot_seconds', max(now - view.last_frame - LIVE_REFRESH_RATE, 0.0))
+    view.last_frame = now
+    view.frames += 1
+    if bench:
+        engine.step(time.time())
+    sync_session(engine, view, timer)
+
+    # 两帧之间的事件合并到下一次渲染；没到渲染时间或没有变化时复用上次的结果
+    # 闲置的会话只按心跳间隔刷新数字，地图按 MAP_MAX_INTERVAL 补发新标记；隐藏的会话没有并入事件，自然什么都不重建
+    idle = st.session_state.activity == 'idle' and not bench
+    now = time.perf_counter()
+    render_due = bench or view.scheduler.due(now)
+    maps_due = bench or view.scheduler.maps_due(now)
 
-# 统计区域
-stats_placeholder = st.empty()
+    # 渲染统计区域
+    if view.stats_html is None or (render_due and view.stats_dirty):
+        view.stats_dirty = False
+        view.stats_html = STATS_ROW(*build_stats_html(view))
+    slots['stats'].markdown(view.stats_html, unsafe_allow_html=True)
+    timer.lap('stats')
+
+    # 渲染地图
+    rebuild_maps = not view.map_specs or (maps_due and view.maps_dirty)
+    names = PROV_NAMES[st.session_state.language]
+    for layer_type in ('birth', 'death'):
+        points = getattr(st.session_state.session, f'{layer_type}_points')
+        view_state = st.session_state[f'{layer_type}_view_state']
+        if MAP_RENDERER == "client":
+            # 只下发上次之后的新标记；没有新数据时重发同一份，浏览器按 now 去重
+            # 页面状态只由出生地图上报一份
+            reporter = layer_type == 'birth'
+            if rebuild_maps:
+                # 以 UTF-8 JSON 字节下发：原样转发，不经 Streamlit 的 dataframe 探测 (会连带导入 pandas)
+                view.map_specs[layer_type] = json.dumps(
+                    live_map_data(points, view.map_sent[layer_type], names, view_state,
+                                  idle_after=IDLE_AFTER if reporter else None),
+                    separators=(',', ':'), ensure_ascii=False
+                ).encode()
+                if len(points):
+                    view.map_sent[layer_type] = float(points.ts[points.order()[-1]])
+            # 基准测试在一次脚本运行里输出多帧，key 要逐帧区分
+            key = f'{layer_type}-live-map' + (f'-{view.frames}' if bench else '')
+            # 上报的视角、页面状态变化都会让片段立即重跑一次，下一帧起按新视角裁剪、按新状态节流
+            callbacks = {'on_view_change': lambda: None}
+            if reporter:
+                callbacks['on_activity_change'] = lambda: None
+            with slots[layer_type]:
+                result = get_live_map()(key=key, data=view.map_specs[layer_type], height=MAP_HEIGHT, **callbacks)
+            follow_view(view, layer_type, result.get('view'))
+            if reporter:
+                st.session_state.activity = result.get('activity') or 'active'
+        else:
+            if rebuild_maps:
+                view.map_specs[layer_type] = map_spec(
+                    points.map_data(names, geo=get_geography(), view=(view_state.latitude, view_state.longitude, view_state.zoom)),
+                    view_state,
+                    layer_type
+                )
+            slots[layer_type].pydeck_chart(DeckSpec(view.map_specs[layer_type]), width="stretch")
+            if layer_type == 'birth' and not bench:
+                # 探针放在出生地图下面；基准测试的 slots 是 st.empty，只容得下地图本身
+                with slots[layer_type]:
+                    result = get_activity_probe()(key='activity-probe', data=ACTIVITY_DATA, on_activity_change=lambda: None)
+                st.session_state.activity = result.get('activity') or 'active'
+        timer.lap(f'{layer_type}_map')
+    if rebuild_maps:
+        view.maps_dirty = False
+        view.scheduler.maps_at = time.perf_counter()
+
+    if render_due:
+        view.scheduler.rendered(view.last_frame, sum(timer.stages.values()), engine.active_sessions(),
+                                IDLE_FRAME_INTERVAL if idle else 0.0)
+    elif metrics:
+        metrics.inc('frames_deferred_total')
+    if metrics:
+        for stage_name, seconds in timer.stages.items():
+            metrics.observe('frame_stage_seconds', seconds, stage=stage_name)
+        metrics.set('frame_interval_seconds', view.scheduler.interval)
+        metrics.heartbeat(
+            st.session_state.session_id,
+            sum(len(ring) for ring in st.session_state.session.rings)
+        )
+    view.timer = timer
+    return timer
+
+def event_source():
+    """回放中读本会话的回放源，否则读当前倍速的共享引擎。"""
+    return st.session_state.replay or get_engine(st.session_state.time_scale)
+
+@st.fragment(run_every=LIVE_REFRESH_RATE)
+def live_area():
+    """实时区域只有这一个定时片段：统计区、两张地图和省份表格在同一次重跑里输出，每个刷新周期只重跑一次。"""
+    engine = event_source()
+    view = st.session_state.live
+    live_frame(make_live_slots(), engine, get_metrics(), view)
+    with st.expander(get_txt('stat_tab_title'), expanded=True) as table_box:
+        board_scope = board_scope_radio()
+        started = time.perf_counter()
+        table_frame(table_box, view, board_scope)
+        if get_metrics():
+            get_metrics().observe('frame_stage_seconds', time.perf_counter() - started, stage='table')
+    save_session(engine, view)
+
+# 基准测试 (benchmarks/bench_frame.py) 通过 session_state 注入：只跑指定帧数、每帧同步生成事件
+bench_frames = st.session_state.get('bench_frames')
 
 # ==========================================
 # 8. 省份数据表格 (Expander 样式)
 # ==========================================
-st.markdown("---")
-with st.expander(get_txt('stat_tab_title'), expanded=True):
-    prov_table_placeholder = st.empty()
+# 值为统计天数：None 本会话，-1 今日全网 (所有进程共享的计数)，0 全部历史
+BOARD_SCOPES = {'board_session': None, 'board_today': -1, 'board_week': 7, 'board_all': 0}
+
+def table_frame(slot, view, board_scope):
+    """省份表格：仅在 TOP 10 变化时重建 (同一范围和语言下最多每 TABLE_REFRESH_RATE 秒一次)，否则复用上次的表格。"""
+    if st.session_state.activity == 'hidden' and view.table is not None:
+        # 隐藏的页面看不到表格，不查计数，直接重发上次的
+        board_key = view.table[0]
+    elif BOARD_SCOPES[board_scope] is None:
+        board = st.session_state.session.board
+        board_key = (board_scope, st.session_state.language, board.version)
+    else:
+        days = BOARD_SCOPES[board_scope]
+        history = get_counters().snapshot()[2:] if days < 0 else load_province_history(days or None)
+        board = None
+        board_key = (board_scope, st.session_state.language, history[0].tobytes(), history[1].tobytes())
+    now = time.time()
+    stale = view.table is None or view.table[0] != board_key
+    if stale and view.table is not None and view.table[0][:2] == board_key[:2] and now - view.table_at < TABLE_REFRESH_RATE:
+        stale = False  # 只是数字变了：攒到下一个表格周期再重建
+    if stale:
+        view.table_at = now
+        board = board or ProvinceBoard.from_counts(*history)
+        import pyarrow as pa  # 首次画表格时才导入，不拖慢页面上方元素的首次显示
+
+        table, born_max, death_max = board.frame(st.session_state.language)
+        # 只在 TOP 10 变化时转换一次；直接给 Arrow 表，复用时 st.dataframe 每帧只做一次序列化，不再经 pandas 转换
+        df_stats = pa.table(table)
+        _, born_col, death_col = BOARD_COLUMNS[st.session_state.language]
+        cols_cfg = {
+            born_col: st.column_config.ProgressColumn(
+                born_col, format="%d",
+                min_value=0, max_value=born_max
+            ),
+            death_col: st.column_config.ProgressColumn(
+                death_col, format="%d",
+                min_value=0, max_value=death_max
+            )
+        }
+        view.table = (board_key, df_stats, cols_cfg)
+    _, df_stats, cols_cfg = view.table
+    slot.dataframe(
+        df_stats,
+        width="stretch",
+        column_config=cols_cfg,
+        hide_index=True
+    )
+
+def board_scope_radio():
+    texts = TEXTS[st.session_state.language]
+    return st.radio(
+        texts['stat_tab_title'],
+        list(BOARD_SCOPES),
+        format_func=texts.get,
+        horizontal=True,
+        key='board_scope',
+        label_visibility="collapsed"
+    )
+
+# 地图上方的留白放在片段外面，只随整页运行输出一次
+st.write("")
+if bench_frames is None:
+    live_area()
+else:
+    live_slots = make_live_slots(replace=True)
+    with st.expander(get_txt('stat_tab_title'), expanded=True):
+        bench_scope = board_scope_radio()
+        table_slot = st.empty()
+
+# ==========================================
+# 8.1 历史回放 (从事件日志按倍速重放，沿用实时区域和表格的渲染)
+# ==========================================
+@st.fragment
+def replay_panel():
+    texts = TEXTS[st.session_state.language]
+    st.session_state.setdefault(
+        'replay_from', (datetime.datetime.now() - datetime.timedelta(hours=1)).replace(second=0, microsecond=0)
+    )
+    c_from, c_speed = st.columns([2, 1])
+    with c_from:
+        st.datetime_input(texts['replay_from'], key='replay_from')
+    with c_speed:
+        st.selectbox(texts['replay_speed'], REPLAY_SPEEDS, index=1, key='replay_speed', format_func=lambda s: f"{s}×")
+
+    def start_replay():
+        reset_live_state()
+        st.session_state.replay = ReplaySource(
+            get_event_log(), get_engine(), st.session_state.replay_from.timestamp(), st.session_state.replay_speed
+        )
+
+    def stop_replay():
+        reset_live_state()
+        st.session_state.replay = None
+
+    replay = st.session_state.replay
+    c_start, c_stop = st.columns(2)
+    c_start.button(texts['replay_start'], width="stretch", on_click=start_replay)
+    c_stop.button(texts['replay_stop'], width="stretch", on_click=stop_replay, disabled=replay is None)
+    if replay is not None:
+        since = datetime.datetime.fromtimestamp(replay.start).strftime('%m-%d %H:%M')
+        st.caption(texts['replay_done'] if replay.finished else texts['replay_status'].format(time=since, speed=replay.speed))
+
+if bench_frames is None:
+    with st.expander(get_txt('replay_title'), expanded=False):
+        replay_panel()
 
 # ==========================================
 # 9. 咖啡打赏 (和省份数据一样的 Expander 下拉/隐藏效果)
 # ==========================================
+# 随附的收款码图片 (可选)，缺失时改为本地生成二维码，渲染路径上不再访问外部服务
+PAY_IMAGES = {'WeChat': 'wechat_pay.jpg', 'Alipay': 'ali_pay.jpg', 'PayPal': 'paypal.png'}
+PAY_IMAGE_WIDTH = 360  # 收款码缩到的宽度 (像素)，约为显示宽度的两倍，高分屏也清晰
+QR_CACHE_SIZE = 128    # 本地二维码按 (支付方式, 金额) 缓存，超出后淘汰最久未用的
+
+@st.cache_resource
+def load_pay_images():
+    """进程启动后把收款码解码、缩小一次，之后只从内存取 (字节, 格式)；没有的文件不出现在结果里。"""
+    from PIL import Image
+
+    images = {}
+    for method, name in PAY_IMAGES.items():
+        try:
+            with Image.open(os.path.join(APP_DIR, name)) as im:
+                fmt = im.format or "PNG"
+                im.thumbnail((PAY_IMAGE_WIDTH, PAY_IMAGE_WIDTH * 2), Image.LANCZOS)
+                buf = io.BytesIO()
+                im.save(buf, format=fmt)
+        except OSError:
+            continue
+        images[method] = (buf.getvalue(), fmt)
+    return images
+
+@st.cache_data(max_entries=QR_CACHE_SIZE, show_spinner=False)
+def qr_png(method, amount, link=None):
+    """本地生成收款二维码 (PNG 字节)；有付款链接时编码链接，否则编码金额和支付方式。"""
+    import qrcode
+
+    qr = qrcode.QRCode(box_size=8, border=2)
+    qr.add_data(link or f"Donate_{amount}_{method}")
+    buf = io.BytesIO()
+    qr.make_image().save(buf, format="PNG")
+    return buf.getvalue()
+
 #st.markdown("---")
-with st.expander(get_txt('coffee_title'), expanded=False):  # 默认收起
+# 打赏区是独立片段：点按钮、改杯数只重跑这一块，不影响实时区域
+@st.fragment
+def donate_panel():
     # 触发气球动画（关键修复：在当前渲染周期执行）
     if st.session_state.show_balloons:
         st.balloons()
         # 执行完动画后重置状态（避免重复触发）
         st.session_state.show_balloons = False
-        st.session_state.donate_success = True
-    
-    # 打赏成功提示
-    if st.session_state.donate_success:
-        st.success(get_txt('pay_success'))
-        # 3秒后自动关闭提示
-        time.sleep(3)
-        st.session_state.donate_success = False
-        st.rerun()
+        # 打赏成功提示 (toast 自动消失，不再 sleep 阻塞)
+        st.toast(get_txt('pay_success'))
     
     st.markdown(f"<div style='text-align:center; color:#f1f5f9; margin-bottom:20px;'>{get_txt('coffee_desc')}</div>", unsafe_allow_html=True)
 
@@ -418,7 +1270,7 @@ with st.expander(get_txt('coffee_title'), expanded=False):  # 默认收起
             with preset_cols[i]:
                 st.button(
                     f"{icon} {num}", 
-                    use_container_width=True, 
+                    width="stretch", 
                     key=f"preset_btn_{num}", 
                     on_click=update_coffee_num, 
                     args=(num,)
@@ -439,7 +1291,7 @@ with st.expander(get_txt('coffee_title'), expanded=False):  # 默认收起
         usd_total = cnt * 2
 
         # 支付方式渲染函数
-        def render_pay_tab(title, amount_str, color_class, img_path, qr_data_suffix, link_url=None):
+        def render_pay_tab(title, amount_str, color_class, method, link_url=None):
             with st.container(border=True):
                 st.markdown(f"""
                     <div style="text-align: center;">
@@ -450,16 +1302,9 @@ with st.expander(get_txt('coffee_title'), expanded=False):  # 默认收起
                 
                 c_img_1, c_img_2, c_img_3 = st.columns([1, 4, 1])
                 with c_img_2:
-                    if os.path.exists(img_path): 
-                        st.image(img_path, use_container_width=True)
-                    else:
-                        qr_data = f"Donate_{cny_total}_{qr_data_suffix}"
-                        if link_url: 
-                            qr_data = link_url
-                        st.image(
-                            f"https://api.qrserver.com/v1/create-qr-code/?size=180x180&data={qr_data}",
-                            use_container_width=True
-                        )
+                    # 标明原格式，st.image 就不会每次重跑都重新编码
+                    image, fmt = load_pay_images().get(method) or (qr_png(method, cny_total, link_url), "PNG")
+                    st.image(image, width="stretch", output_format=fmt)
                 
                 if link_url:
                     st.write("")
@@ -467,7 +1312,7 @@ with st.expander(get_txt('coffee_title'), expanded=False):  # 默认收起
                         f"👉 Pay {amount_str}",
                         link_url,
                         type="primary",
-                        use_container_width=True
+                        width="stretch"
                     )
                 else:
                     st.markdown("""
@@ -480,186 +1325,73 @@ with st.expander(get_txt('coffee_title'), expanded=False):  # 默认收起
         st.write("")
         t1, t2, t3 = st.tabs([get_txt('pay_wechat'), get_txt('pay_alipay'), get_txt('pay_paypal')])
         with t1: 
-            render_pay_tab("WeChat Pay", f"¥{cny_total}", "color-wechat", "wechat_pay.jpg", "WeChat")
+            render_pay_tab("WeChat Pay", f"¥{cny_total}", "color-wechat", "WeChat")
         with t2: 
-            render_pay_tab("Alipay", f"¥{cny_total}", "color-alipay", "ali_pay.jpg", "Alipay")
+            render_pay_tab("Alipay", f"¥{cny_total}", "color-alipay", "Alipay")
         with t3: 
-            render_pay_tab("PayPal", f"${usd_total}", "color-paypal", "paypal.png", "PayPal", "https://paypal.me/ytqz")
+            render_pay_tab("PayPal", f"${usd_total}", "color-paypal", "PayPal", "https://paypal.me/ytqz")
         
-        # 打赏成功按钮（核心修复：先标记动画状态，再rerun）
+        # 打赏成功按钮（先标记动画状态，片段随后重跑时播放）
         def trigger_donate_success():
             # 标记需要显示气球动画
             st.session_state.show_balloons = True
-            # 触发rerun，让动画在新的渲染周期执行
-            st.rerun()
         
         st.write("")
         if st.button(
             "🎉 " + get_txt('pay_success').split('!')[0],
             type="primary",
-            use_container_width=True,
+            width="stretch",
             on_click=trigger_donate_success
         ):
             pass
 
+with st.expander(get_txt('coffee_title'), expanded=False):  # 默认收起
+    donate_panel()
+
 # ==========================================
-# 10. 动画主循环
+# 9.1 调试面板 (URL 带 ?debug=1 时才显示)
 # ==========================================
-REFRESH_RATE = 0.8
-BIRTH_PROB = 0.6
-DEATH_PROB = 0.5
-CLEAN_INTERVAL = 5
-clean_counter = 0
-
-while True:
-    ts = time.time()
-    t_str = datetime.datetime.now().strftime('%H:%M:%S')
-    clean_counter += 1
-    
-    # 生成出生数据
-    if random.random() < BIRTH_PROB:
-        st.session_state.total_born += 1
-        baby = generate_baby()
-        p_name = baby['zh'] if st.session_state.language == 'zh' else baby['en']
-        log_key = 'log_boy' if baby['gender'] == 'm' else 'log_girl'
-        log_text = get_txt(log_key).format(time=t_str, prov=p_name)
-        st.session_state.born_log.insert(0, {"t": log_text, "c": baby['color']})
-        if len(st.session_state.born_log) > 6: 
-            st.session_state.born_log.pop()
-        new_row = pd.DataFrame([{
-            'lat': baby['lat'], 
-            'lon': baby['lon'], 
-            'color': baby['color'], 
-            'size': 80000, 
-            'born_time': ts, 
-            'name': p_name
-        }])
-        st.session_state.birth_map_data = pd.concat(
-            [st.session_state.birth_map_data, new_row], 
-            ignore_index=True
-        )
-
-    # 生成死亡数据
-    if random.random() < DEATH_PROB:
-        st.session_state.total_death += 1
-        death = generate_death()
-        p_name = death['zh'] if st.session_state.language == 'zh' else death['en']
-        log_text = get_txt('log_death').format(time=t_str, prov=p_name)
-        st.session_state.death_log.insert(0, {"t": log_text, "c": death['color']})
-        if len(st.session_state.death_log) > 6: 
-            st.session_state.death_log.pop()
-        new_row = pd.DataFrame([{
-            'lat': death['lat'], 
-            'lon': death['lon'], 
-            'color': death['color'], 
-            'size': 30000, 
-            'death_time': ts, 
-            'name': p_name
-        }])
-        st.session_state.death_map_data = pd.concat(
-            [st.session_state.death_map_data, new_row], 
-            ignore_index=True
-        )
+DEBUG_PANEL = st.query_params.get("debug") == "1"
+DEBUG_REFRESH_RATE = 2.0  # 调试面板的刷新间隔（秒）
 
-    # 清理过期数据
-    if clean_counter >= CLEAN_INTERVAL:
-        for data_key, time_col in [('birth_map_data', 'born_time'), ('death_map_data', 'death_time')]:
-            data = st.session_state[data_key]
-            if not data.empty: 
-                st.session_state[data_key] = data[data[time_col] > (ts - 3.0)]
-        clean_counter = 0
+@st.fragment(run_every=DEBUG_REFRESH_RATE)
+def debug_panel():
+    timer = st.session_state.live.timer
+    if timer:
+        st.caption(f"frame: {', '.join(f'{k} {v * 1000:.2f}ms' for k, v in timer.stages.items())}")
+    rings = st.session_state.session.rings
+    st.caption(f"activity: {st.session_state.activity}, state: {session_footprint(st.session_state.live, rings) / 1024:.1f} KB")
+    if 'restore_ms' in st.session_state:
+        st.caption(f"restored from snapshot in {st.session_state.restore_ms:.2f}ms")
+    metrics = get_metrics()
+    if metrics is None:
+        st.caption("BAOBEI_METRICS=1 to enable process-wide metrics")
+        return
+    rows, values = metrics.summary()
+    st.dataframe(rows, width="stretch", hide_index=True)
+    st.json(values, expanded=False)
 
-    # 渲染统计区域
-    with stats_placeholder.container():
-        c1, c2, c3, c4 = st.columns([1, 2, 2, 1])
-        with c1: 
-            st.markdown(f'''
-                <div class="stat-box">
-                    <div class="stat-val">{st.session_state.total_born}</div>
-                    <div class="stat-label">{get_txt("born_count")}</div>
-                </div>
-            ''', unsafe_allow_html=True)
-        with c2: 
-            log_html = "".join([
-                f'<div class="log-item" style="color:{"#22d3ee" if l["c"][0]==0 else "#e879f9"}">{l["t"]}</div>' 
-                for l in st.session_state.born_log
-            ])
-            st.markdown(f'<div class="log-container">{log_html}</div>', unsafe_allow_html=True)
-        with c3:
-            death_log_html = "".join([
-                f'<div class="death-log-item">{l["t"]}</div>' 
-                for l in st.session_state.death_log
-            ])
-            st.markdown(f'<div class="log-container">{death_log_html}</div>', unsafe_allow_html=True)
-        with c4: 
-            st.markdown(f'''
-                <div class="stat-box">
-                    <div class="stat-death-val">{st.session_state.total_death}</div>
-                    <div class="stat-label">{get_txt("death_count")}</div>
-                </div>
-            ''', unsafe_allow_html=True)
+if DEBUG_PANEL:
+    with st.expander("🛠 Debug", expanded=False):
+        debug_panel()
 
-    # 渲染地图
-    render_map(
-        birth_map_placeholder, 
-        st.session_state.birth_map_data, 
-        st.session_state.birth_view_state, 
-        get_txt('born_count'), 
-        "birth"
-    )
-    render_map(
-        death_map_placeholder, 
-        st.session_state.death_map_data, 
-        st.session_state.death_view_state, 
-        get_txt('death_count'), 
-        "death"
-    )
-        
-    # 渲染省份数据表格
-    with prov_table_placeholder.container():
-        prov_data = []
-        for prov_zh, stats in st.session_state.prov_stats.items():
-            prov_data.append({
-                '省份': prov_zh, 
-                'Province': stats['en'], 
-                '新生': stats['born'], 
-                'Born': stats['born'], 
-                '离世': stats['death'], 
-                'Deaths': stats['death']
-            })
-        df_stats = pd.DataFrame(prov_data)
-        df_stats['Total'] = df_stats['新生'] + df_stats['离世']
-        df_stats = df_stats.sort_values(by='Total', ascending=False).head(10)
-        
-        if st.session_state.language == 'zh':
-            display_cols = ['省份', '新生', '离世']
-            cols_cfg = {
-                "新生": st.column_config.ProgressColumn(
-                    "新生", format="%d", 
-                    min_value=0, max_value=max(int(df_stats['新生'].max()), 10)
-                ),
-                "离世": st.column_config.ProgressColumn(
-                    "离世", format="%d",
-                    min_value=0, max_value=max(int(df_stats['离世'].max()), 10)
-                )
-            }
-        else:
-            display_cols = ['Province', 'Born', 'Deaths']
-            cols_cfg = {
-                "Born": st.column_config.ProgressColumn(
-                    "Born", format="%d",
-                    min_value=0, max_value=max(int(df_stats['Born'].max()), 10)
-                ),
-                "Deaths": st.column_config.ProgressColumn(
-                    "Deaths", format="%d",
-                    min_value=0, max_value=max(int(df_stats['Deaths'].max()), 10)
-                )
-            }
-        st.dataframe(
-            df_stats[display_cols],
-            use_container_width=True,
-            column_config=cols_cfg,
-            hide_index=True
+# ==========================================
+# 10. 基准测试模式：同一次脚本运行里逐帧驱动实时区域
+# ==========================================
+if bench_frames is not None:
+    frame_log = st.session_state.get('frame_log')
+    # 基准测试用自己的引擎：不启动后台线程，也不接数据库、事件日志和共享计数，只由下面逐帧同步推进；
+    # 用共享引擎的话，脚本线程和后台线程会同时写这些状态，事件也会按两倍速率生成
+    # 引擎跟着会话走，同一会话多次运行时批次序号接得上 (游标仍然有效)
+    bench_engine = st.session_state.get('bench_engine')
+    if bench_engine is None or bench_engine.time_scale != st.session_state.time_scale:
+        bench_engine = st.session_state.bench_engine = LifeEngine(
+            REFRESH_RATE, SIM_SEED, st.session_state.time_scale, metrics=get_metrics()
         )
-
-    time.sleep(REFRESH_RATE)
+        st.session_state.event_cursor = None
+    for _ in range(bench_frames):
+        timer = live_frame(live_slots, bench_engine, get_metrics(), st.session_state.live, bench=True)
+        table_frame(table_slot, st.session_state.live, bench_scope)
+        timer.lap('table')
+        if frame_log is not None:
+            frame_log.append(timer.stages)
@@ -0,0 +1,258 @@
+import struct
+import time
+
+import numpy as np
+import pytest
+
+import lifesim
+from lifesim import (
+    EVENT_DTYPE, PROVINCES, SNAPSHOT_MAGIC, TOP_N, EventLog, LifeEngine, PointRing, ProvinceBoard, SharedCounters,
+    missed_counts, pack_snapshot, unpack_snapshot,
+)
+
+# ==========================================
+# 1. 地图点环形缓冲
+# ==========================================
+def fill(ring, ts):
+    """按时间戳追加一组标记，其余各列取可辨认的值 (place 与时间戳相同)。"""
+    ts = np.asarray(ts, dtype=np.float64)
+    n = len(ts)
+    lat = lon = ts.astype(np.float32)
+    ring.extend(lat, lon, np.array([1, 2, 3, 4], dtype=np.uint8), 1.0, ts, np.arange(n, dtype=np.int16) % len(PROVINCES),
+                ts.astype(np.int32))
+
+def live_ts(ring):
+    return ring.ts[ring.order()].tolist()
+
+def test_ring_wraps_and_keeps_newest():
+    ring = PointRing(8)
+    fill(ring, range(5))
+    fill(ring, range(5, 10))
+    assert len(ring) == 8 and ring.start == 2
+    assert live_ts(ring) == list(range(2, 10))
+    assert ring.place[ring.order()].tolist() == list(range(2, 10))
+    # 一批超过容量：只留最新的 capacity 条
+    fill(ring, range(10, 30))
+    assert live_ts(ring) == list(range(22, 30))
+
+@pytest.mark.parametrize("cutoff", [1.0, 2.0, 4.0, 7.0, 7.5, 8.0, 9.0, 100.0])
+def test_ring_expire_across_wraparound(cutoff):
+    ring = PointRing(8)
+    fill(ring, range(5))
+    fill(ring, range(5, 10))  # 下标 2..7 存 2..7，绕回的 0..1 存 8、9
+    expected = [t for t in range(2, 10) if t > cutoff]
+    assert ring.expire(cutoff) == 8 - len(expected)
+    assert live_ts(ring) == expected
+
+def test_ring_release_and_reallocate():
+    ring = PointRing(8)
+    assert ring.nbytes == 0
+    fill(ring, range(3))
+    assert ring.nbytes == 8 * PointRing.ROW_BYTES
+    ring.release()
+    assert ring.nbytes == 0 and len(ring) == 0 and ring.expire(100.0) == 0
+    fill(ring, range(3, 6))
+    assert ring.nbytes == 8 * PointRing.ROW_BYTES
+    assert live_ts(ring) == [3, 4, 5]
+
+def test_ring_columns_round_trip():
+    ring = PointRing(8)
+    fill(ring, range(11))
+    copy = PointRing(8)
+    copy.extend(**ring.columns())
+    for name, _, _ in PointRing.COLUMNS:
+        assert np.array_equal(getattr(copy, name)[copy.order()], getattr(ring, name)[ring.order()])
+
+# ==========================================
+# 2. 省份排行榜
+# ==========================================
+def full_rank(board):
+    total = board.born + board.death
+    idx = np.arange(len(total))
+    return idx[np.lexsort((idx, -total))][:TOP_N]
+
+def test_board_incremental_top_matches_full_sort():
+    rng = np.random.default_rng(7)
+    n = len(PROVINCES)
+    board = ProvinceBoard()
+    weights = rng.random(n) ** 3  # 强度悬殊，榜首稳定、榜尾常有进出
+    weights /= weights.sum()
+    shown = (board.top.tolist(), [])
+    for i in range(300):
+        if i % 10 == 9:
+            changed = board.add_counts(rng.poisson(5, n), None)
+        else:
+            changed = board.add(rng.choice(n, rng.integers(0, 6), p=weights), rng.choice(n, rng.integers(0, 3)))
+        assert np.array_equal(board.top, full_rank(board))
+        now = (board.top.tolist(), (board.born[board.top] + board.death[board.top]).tolist())
+        # 名次或榜上数值有变化时才算变化；数值只在本批触及的省份上变
+        assert changed == (now[0] != shown[0] or now[1] != shown[1])
+        shown = now
+
+def test_board_version_counts_changes():
+    board = ProvinceBoard()
+    assert not board.add()
+    assert board.version == 0
+    assert board.add(np.array([3, 3, 5]))
+    assert board.version == 1
+    assert board.top[:2].tolist() == [3, 5]
+
+# ==========================================
+# 3. 状态快照
+# ==========================================
+def test_snapshot_round_trip():
+    arrays = {
+        'ts': np.array([1.5, 2.5], dtype=np.float64),
+        'rgba': np.arange(8, dtype=np.uint8).reshape(2, 4),
+        'empty': np.zeros(0, dtype=np.int16),
+    }
+    meta, out = unpack_snapshot(pack_snapshot({'lang': '中文', 'n': 2}, arrays))
+    assert meta == {'lang': '中文', 'n': 2}
+    for name, arr in arrays.items():
+        assert out[name].dtype == arr.dtype and np.array_equal(out[name], arr)
+    out['ts'][0] = 0  # 解出来的是可写副本
+    assert arrays['ts'][0] == 1.5
+
+def snapshot_blob():
+    return pack_snapshot({'n': 1}, {'ts': np.arange(4, dtype=np.float64)})
+
+@pytest.mark.parametrize("blob", [
+    b"",
+    b"BBS0" + snapshot_blob()[4:],                                   # 魔数不对
+    SNAPSHOT_MAGIC + b"\x01",                                          # 连头长度都不完整
+    SNAPSHOT_MAGIC + struct.pack('<I', 100) + b'{"meta":',            # 头被截断
+    SNAPSHOT_MAGIC + struct.pack('<I', 2) + b"\xff\xfe",              # 头不是 UTF-8
+    snapshot_blob()[:-8],                                              # 数组字节被截断
+])
+def test_unpack_snapshot_rejects_bad_blobs(blob):
+    with pytest.raises(ValueError):
+        unpack_snapshot(blob)
+
+# ==========================================
+# 4. 事件日志跟读
+# ==========================================
+class Clock:
+    """替换 lifesim.time：time() 返回指定时刻，其余照旧 (后台线程还要 sleep)。"""
+
+    def __init__(self, now):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+def events(n):
+    return np.zeros(n, dtype=np.int16), np.zeros(n, dtype=np.uint8), np.ones(1, dtype=np.int16)
+
+def test_tail_crosses_hour_after_grace(tmp_path, monkeypatch):
+    hour = 490000  # 任意一个整点 (按小时计)
+    start = hour * lifesim.CHUNK_SECONDS
+    log = EventLog(str(tmp_path))
+    log.append(start + 3590, *events(2))
+    log.append(start + 3600 + 1, *events(4))
+    log.flush()
+    # 下一小时文件末尾写了半条记录：只读完整的记录
+    with open(log.chunk_path(hour + 1), 'ab') as f:
+        f.write(b"\0" * (EVENT_DTYPE.itemsize // 2))
+
+    clock = Clock(start + 3600 + lifesim.TAIL_GRACE / 2)
+    monkeypatch.setattr(lifesim, 'time', clock)
+    # 整点刚过、还在宽限期内：上一小时的文件可能还有最后一次落盘，不翻到下一个文件
+    records, cursor = log.tail((hour, 0))
+    assert len(records) == 3 and cursor == (hour, 3)
+    records, cursor = log.tail(cursor)
+    assert len(records) == 0 and cursor == (hour, 3)
+
+    clock.now = start + 3600 + lifesim.TAIL_GRACE + 1
+    records, cursor = log.tail(cursor)
+    assert len(records) == 5 and cursor == (hour + 1, 5)
+    assert (records['ts'] >= start + 3600).all()
+
+def test_tail_skips_missing_hours(tmp_path, monkeypatch):
+    hour = 490000
+    start = hour * lifesim.CHUNK_SECONDS
+    log = EventLog(str(tmp_path))
+    log.append(start + 3 * 3600 + 5, *events(1))
+    log.flush()
+    monkeypatch.setattr(lifesim, 'time', Clock(start + 3 * 3600 + 60))
+    records, cursor = log.tail((hour, 0))
+    assert len(records) == 2 and cursor == (hour + 3, 2)
+
+# ==========================================
+# 5. 共享计数
+# ==========================================
+def test_counters_snapshot_is_consistent_copy(tmp_path):
+    n = len(PROVINCES)
+    counters = SharedCounters(str(tmp_path / "counters.bin"), n)
+    counters.add(time.time(), np.array([0, 0, 5], dtype=np.int16), np.array([7], dtype=np.int16))
+    born, death, born_prov, death_prov = counters.snapshot()
+    assert (born, death) == (3, 1)
+    assert born_prov.sum() == born and death_prov.sum() == death
+    assert born_prov[0] == 2 and death_prov[7] == 1
+    counters.add(time.time(), np.array([1], dtype=np.int16), np.zeros(0, dtype=np.int16))
+    assert born_prov.sum() == 3  # 快照是副本，不随之后的写入变化
+    assert counters.data[0] % 2 == 0
+
+class WriteDuringRead:
+    """读者拷贝完一份之后、核对版本号之前，另一个进程写完了一批。"""
+
+    def __init__(self, reader, writer):
+        self.data, self.writer, self.pending = reader.data, writer, True
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __array__(self, dtype=None, copy=None):
+        snap = np.array(self.data)
+        if self.pending:
+            self.pending = False
+            self.writer.add(time.time(), np.array([4], dtype=np.int16), np.zeros(0, dtype=np.int16))
+        return snap
+
+def test_counters_snapshot_retries_torn_read(tmp_path):
+    path, n = str(tmp_path / "counters.bin"), len(PROVINCES)
+    reader, writer = SharedCounters(path, n), SharedCounters(path, n)
+    writer.add(time.time(), np.array([2], dtype=np.int16), np.zeros(0, dtype=np.int16))
+    reader.data = WriteDuringRead(reader, writer)
+    born, _, born_prov, _ = reader.snapshot()
+    # 第一次拷贝前后版本号不同，重读到的是写完之后的一致状态
+    assert born == 2 and born_prov[2] == 1 and born_prov[4] == 1
+
+def test_counters_repair_after_writer_died(tmp_path):
+    path, n = str(tmp_path / "counters.bin"), len(PROVINCES)
+    counters = SharedCounters(path, n)
+    counters.add(time.time(), np.array([1], dtype=np.int16), np.zeros(0, dtype=np.int16))
+    counters.data[0] += 1  # 上一任写到一半退出，版本号停在奇数
+    assert counters.snapshot()[0] == 1  # 重试次数用完也照样返回，不会卡住
+    SharedCounters(path, n).repair()
+    assert counters.data[0] % 2 == 0
+    counters.add(time.time(), np.array([1], dtype=np.int16), np.zeros(0, dtype=np.int16))
+    assert counters.snapshot()[0] == 2
+
+def test_counters_from_another_day_read_as_zero(tmp_path):
+    counters = SharedCounters(str(tmp_path / "counters.bin"), len(PROVINCES))
+    counters.add(time.time() - 2 * 86400, np.array([1], dtype=np.int16), np.array([2], dtype=np.int16))
+    born, death, born_prov, death_prov = counters.snapshot()
+    assert (born, death) == (0, 0) and not born_prov.any() and not death_prov.any()
+
+# ==========================================
+# 6. 引擎批次
+# ==========================================
+def test_missed_counts_fills_history_gap():
+    engine = LifeEngine(0.8, seed=1, time_scale=3600)
+    seq, born, death = engine.counts()
+    for i in range(lifesim.EVENT_HISTORY + 20):
+        engine.step(engine.sim_start + (i + 1) * engine.sim_dt)
+    batches, _ = engine.events_since(seq)
+    assert batches[0]['seq'] > seq + 1
+    missed_born, missed_death = missed_counts(batches, seq, (born, death))
+    n = len(PROVINCES)
+    total_born = missed_born + sum(np.bincount(b['birth_prov'], minlength=n) for b in batches)
+    total_death = missed_death + sum(np.bincount(b['death_prov'], minlength=n) for b in batches)
+    _, born_now, death_now = engine.counts()
+    assert np.array_equal(total_born, born_now) and np.array_equal(total_death, death_now)
+    # 没有缺口、或不知道游标处的累计时不补
+    assert missed_counts(batches[1:], batches[0]['seq'], (born, death)) is None
+    assert missed_counts(batches, seq, None) is None